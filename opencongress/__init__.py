@@ -1,5 +1,17 @@
+import copy
+
+import opencongress.agreement
+import opencongress.batch
+import opencongress.billstore
+import opencongress.cache
+import opencongress.columns
 import opencongress.calls
 import opencongress.exceptions
+import opencongress.mirror
+import opencongress.paging
+import opencongress.search
+import opencongress.snapshot
+import opencongress.transport
 from opencongress.utils import url_date
 
 class Api(object):
@@ -13,14 +25,291 @@ class Api(object):
     ==========
     key = Your OpenCongress.org API key. Get one at
         http://www.opencongress.org/api
+    maxsize = An integer specifying the maximum number of keep-alive
+        connections held open to opencongress.org at once. Defaults to 4.
+    timeout = A float specifying the socket timeout, in seconds
+    cache = An opencongress.cache.DiskCache in which to keep raw responses,
+        or a string specifying the directory of one. Off by default.
+    results_cache = An opencongress.cache.ResultCache in which to keep
+        processed results in memory. Off by default. Results it answers
+        share their objects with earlier calls; treat them as read-only.
+    validators = An opencongress.cache.ValidatorCache used to revalidate
+        repeated calls with conditional requests. Off by default.
+    lazy = A boolean. If True, result objects decode each of their fields
+        the first time it is read, rather than all of them up front.
+    search_index = An opencongress.search.BillIndex that answers
+        bills_by_query(..., local=True).
+    people_index = An opencongress.search.PeopleIndex that answers
+        people(..., local=True). If not given, one is loaded from people()
+        the first time it is needed.
+    coalesce = A boolean. If True (the default), identical calls made at
+        the same time from several threads share a single request.
+    throttle = An opencongress.transport.Throttle that rate limits, retries
+        and adaptively limits the concurrency of requests. Off by default.
         
     """
     
-    def __init__(self, key):
+    def __init__(self, key, maxsize=4, timeout=None, cache=None, \
+                 results_cache=None, validators=None, lazy=False, \
+                 search_index=None, coalesce=True, throttle=None, \
+                 people_index=None):
         try:
             self.key = key
         except NameError:
             raise exceptions.NoApiKeyProvided()
+        self.pool = transport.ConnectionPool(maxsize, timeout)
+        if isinstance(cache, basestring):
+            cache = opencongress.cache.DiskCache(cache)
+        self.cache = cache
+        self.results_cache = results_cache
+        self.validators = validators
+        self.lazy = lazy
+        self.search_index = search_index
+        self.people_index = people_index
+        self.flights = opencongress.cache.SingleFlight() if coalesce \
+            else None
+        self.throttle = throttle
+    
+    def _prepare(self, call_class, *args, **kwargs):
+        # Builds a validated call, ready to be fetched
+        kwargs['transport'] = self._transport()
+        kwargs['cache'] = self.cache
+        kwargs['validators'] = self.validators
+        kwargs['lazy'] = self.lazy
+        kwargs['fetch'] = False
+        return call_class(self.key, *args, **kwargs)
+    
+    # Methods that do more than return the results of a single request, and
+    # so have no call for _build() to return
+    _unbuildable = frozenset(['batch', 'pipeline', 'to_columns', \
+        'to_records', 'stats', 'compare_many', 'iter_people', 'iter_bills', \
+        'iter_battle_royale'])
+    
+    def _build(self, method, *args, **kwargs):
+        # Returns the call an Api method would make, without making it (or
+        # the method's results, for methods answered locally)
+        if method in self._unbuildable or method.startswith('_') or \
+                not callable(getattr(self, method, None)):
+            raise exceptions.ArgumentError('%s does not make a single call' \
+                % method)
+        if kwargs.get('local'):
+            return getattr(self, method)(*args, **kwargs)
+        builder = copy.copy(self)
+        builder._call = self._prepare
+        return getattr(builder, method)(*args, **kwargs)
+    
+    def _call(self, call_class, *args, **kwargs):
+        call = self._prepare(call_class, *args, **kwargs)
+        
+        if self.results_cache is not None:
+            results = self.results_cache.get(call.cache_key)
+            if results is not None:
+                return results
+        if self.flights is None:
+            return self._fetch(call)
+        return self.flights.do(call.cache_key, lambda: self._fetch(call))
+    
+    def _fetch(self, call):
+        results = call.fetch()
+        if self.results_cache is not None:
+            self._remember(call)
+        return results
+    
+    def _remember(self, call):
+        self.results_cache.set(call.cache_key, call.results, \
+            call.cache_ttl(), call.size)
+    
+    def _transport(self):
+        if self.throttle is None:
+            return self.pool
+        return self.throttle.bind(self.pool)
+    
+    def _iter(self, call_class, *args, **kwargs):
+        kwargs['transport'] = self._transport()
+        kwargs['cache'] = self.cache
+        kwargs['lazy'] = self.lazy
+        kwargs['fetch'] = False
+        return call_class(self.key, *args, **kwargs).iterresults()
+    
+    def stats(self):
+        """
+        Returns usage statistics for this Api instance.
+        
+        Usage
+        =====
+        >>> api.stats()
+        
+        Returns
+        =======
+        {
+            'pool': {'open': 2, 'idle': 2, 'reused': 14},
+            'cache': {'hits': 10, 'misses': 6},
+            'results_cache': {'hits': 40, 'misses': 16, 'entries': 16,
+                'bytes': 1048576},
+            'validators': {'entries': 3, 'not_modified': 12},
+            'flights': {'in_flight': 1, 'coalesced': 27},
+            'throttle': {'requests': 58, 'retries': 2, 'failures': 2,
+                'waited': 3.5, 'active': 2, 'concurrency': 4}
+        }
+        
+        """
+        stats = {'pool': self.pool.stats()}
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        if self.results_cache is not None:
+            stats['results_cache'] = self.results_cache.stats()
+        if self.validators is not None:
+            stats['validators'] = self.validators.stats()
+        if self.flights is not None:
+            stats['flights'] = self.flights.stats()
+        if self.throttle is not None:
+            stats['throttle'] = self.throttle.stats()
+        return stats
+    
+    def batch(self, calls, max_workers=4, ordered=True):
+        """
+        Runs many calls concurrently on a pool of worker threads. A failing
+        call does not abort the batch; its exception is reported on its
+        result instead.
+        
+        Usage
+        =====
+        >>> api.batch([
+        ...     ('people', {'person_id': 300056}),
+        ...     ('bills_by_ident', ['111-h2454', '111-h3962']),
+        ...     'hot_bills',
+        ... ], max_workers=8)
+        
+        Returns
+        =======
+        [
+            <OpenCongress BatchResult object (people: ok)>,
+            <OpenCongress BatchResult object (bills_by_ident: ok)>,
+            <OpenCongress BatchResult object (hot_bills: HTTPError(503,))>
+        ]
+        
+        Arguments
+        =========
+        calls = A list of call specifications: the name of an Api method,
+            optionally followed by a list of positional arguments and/or a
+            dictionary of keyword arguments
+        
+        Keyword arguments
+        =================
+        max_workers = An integer specifying the number of worker threads
+        ordered = A boolean. If True (the default), returns a list of results
+            in the order of calls; if False, returns an iterator that yields
+            results as they complete
+        
+        """
+        return batch.run(self, calls, max_workers, ordered)
+    
+    def pipeline(self, calls, fetch_workers=4, parse_workers=1, \
+                 queue_size=8, ordered=True):
+        """
+        Like batch(), but splits each call into two stages that run on
+        separate threads: fetch workers download raw responses while parse
+        workers decompress and parse the ones already downloaded, so network
+        time and parsing time overlap instead of adding up.
+        
+        Usage
+        =====
+        >>> results = api.pipeline([('bills', {'congress': c}) for c in
+        ...     range(100, 112)], fetch_workers=6)
+        >>> for result in results:
+        ...     print result.results
+        >>> results.stats()
+        
+        Returns
+        =======
+        <opencongress.batch.Pipeline object>, an iterator of BatchResults
+        whose stats() method returns {'fetch_time': 5.2, 'parse_time': 3.9,
+            'wall_time': 5.6}
+        
+        Arguments
+        =========
+        calls = A list of call specifications, as for batch()
+        
+        Keyword arguments
+        =================
+        fetch_workers = An integer specifying the number of download threads
+        parse_workers = An integer specifying the number of parsing threads
+        queue_size = An integer specifying how many downloaded responses may
+            wait to be parsed before the fetch workers pause
+        ordered = A boolean. If True (the default), yields results in the
+            order of calls; if False, as they complete
+        
+        """
+        return batch.Pipeline(self, calls, fetch_workers, parse_workers, \
+            queue_size, ordered)
+    
+    def to_columns(self, method, *args, **kwargs):
+        """
+        Makes a call and returns its results as NumPy arrays, one per field,
+        read straight from the XML in a single pass without building a
+        Bill/Person/Issue object per result. Requires NumPy.
+        
+        Usage
+        =====
+        >>> api.to_columns('bills', congress=111, fields=['id', 'introduced',
+        ...     'bill_type'], categorical=['bill_type'])
+        
+        Returns
+        =======
+        OrderedDict([
+            ('id', array([57656, 60845, ...])),
+            ('introduced', array([1242964800, 1256270400, ...])),
+            ('bill_type', <opencongress.columns.Categorical object>)
+        ])
+        
+        Arguments
+        =========
+        method = The name of an Api method returning a list of bills, people
+            or issues, followed by its arguments
+        
+        Keyword arguments
+        =================
+        fields = A list of the fields to keep. All fields by default.
+        categorical = A list of string fields to return as
+            opencongress.columns.Categorical codes
+        
+        See opencongress.columns.ColumnBuilder.columns() for the types of the
+        arrays. opencongress.columns.to_columns() does the same for a list of
+        results already in hand.
+        
+        """
+        fields = kwargs.pop('fields', None)
+        categorical = kwargs.pop('categorical', ())
+        return self._columns(method, fields, args, kwargs).columns( \
+            categorical)
+    
+    def to_records(self, method, *args, **kwargs):
+        """
+        Like to_columns(), but returns a NumPy record array.
+        
+        Usage
+        =====
+        >>> api.to_records('people', state='MN', fields=['person_id',
+        ...     'user_approval'])
+        
+        Returns
+        =======
+        rec.array([(400068, 6.0), ...],
+            dtype=[('person_id', '<i8'), ('user_approval', '<f8')])
+        
+        """
+        fields = kwargs.pop('fields', None)
+        categorical = kwargs.pop('categorical', ())
+        return self._columns(method, fields, args, kwargs).records( \
+            categorical)
+    
+    def _columns(self, method, fields, args, kwargs):
+        # Returns a ColumnBuilder filled with the results of a method: from
+        # the XML of its call, or from the objects of a local answer
+        call = self._build(method, *args, **kwargs)
+        if isinstance(call, calls.ApiCall):
+            return columns.from_call(call, fields)
+        return columns.from_results(call, fields)
         
     def people(self, *args, **kwargs):
         """
@@ -50,9 +339,34 @@ class Api(object):
         user_approval = A two-tuple specifying the low and high ends of the 
             average OpenCongress user's approval rating - e.g.(2.5, 7.5,). 
             Minimum 0.0, maximum 10.0.
+        local = A boolean. If True, answers from this Api's people_index
+            instead of OpenCongress.org
+        
+        """
+        if kwargs.pop('local', False):
+            if self.people_index is None:
+                self.people_index = search.PeopleIndex( \
+                    self._call(calls.People))
+            return self.people_index.query(**kwargs)
+        return self._call(calls.People, *args, **kwargs)
+    
+    def iter_people(self, *args, **kwargs):
+        """
+        Like people(), but returns an iterator that yields each person as soon
+        as it has been read from the response, without holding the whole
+        response in memory. Accepts the same keyword arguments as people().
+        
+        Usage
+        =====
+        >>> for person in api.iter_people(state='MN'):
+        ...     print person
+        
+        Returns
+        =======
+        <generator of OpenCongress Person objects>
         
         """
-        return calls.People(self.key, *args, **kwargs).results
+        return self._iter(calls.People, *args, **kwargs)
     
     def senators_most_in_the_news_this_week(self):
         """
@@ -70,7 +384,7 @@ class Api(object):
         ]
         
         """
-        return calls.SenatorsMostInTheNewsThisWeek(self.key).results
+        return self._call(calls.SenatorsMostInTheNewsThisWeek)
     
     def representatives_most_in_the_news_this_week(self):
         """
@@ -88,7 +402,7 @@ class Api(object):
         ]
         
         """
-        return calls.RepresentativesMostInTheNewsThisWeek(self.key).results
+        return self._call(calls.RepresentativesMostInTheNewsThisWeek)
     
     def most_blogged_senators_this_week(self):
         """
@@ -106,7 +420,7 @@ class Api(object):
         ]
 
         """
-        return calls.MostBloggedSenatorsThisWeek(self.key).results
+        return self._call(calls.MostBloggedSenatorsThisWeek)
     
     def most_blogged_representatives_this_week(self):
         """
@@ -124,7 +438,7 @@ class Api(object):
         ]
         
         """
-        return calls.MostBloggedRepresentativesThisWeek(self.key).results
+        return self._call(calls.MostBloggedRepresentativesThisWeek)
     
     def compare_two_people(self, person1, person2, *args, **kwargs):
         """
@@ -155,7 +469,62 @@ class Api(object):
         """
         kwargs['person1'] = person1
         kwargs['person2'] = person2
-        return calls.CompareTwoPeople(self.key, *args, **kwargs).results
+        return self._call(calls.CompareTwoPeople, *args, **kwargs)
+    
+    def compare_many(self, person_ids, max_workers=None):
+        """
+        Compares every pair of the passed people, concurrently, and returns
+        their positions on the roll calls they voted on as an
+        opencongress.agreement.VoteMatrix, from which agreement and
+        similarity matrices are computed with NumPy. Requires NumPy.
+        
+        Each unordered pair is requested once; duplicate IDs are dropped.
+        Pairs that could not be compared are listed in the matrix's errors.
+        
+        Usage
+        =====
+        >>> matrix = api.compare_many([300022, 400629, 412378])
+        >>> matrix.agreement()
+        
+        Returns
+        =======
+        <opencongress.agreement.VoteMatrix object>
+        
+        Arguments
+        =========
+        person_ids = A list of integers specifying people's OpenCongress IDs
+        
+        Keyword arguments
+        =================
+        max_workers = An integer specifying how many comparisons may be made
+            at once. Defaults to the size of the connection pool.
+        
+        """
+        people, pairs = self._pairs(person_ids)
+        results = batch.run(self, [('compare_two_people', pair) \
+            for pair in pairs], max_workers or self.pool.maxsize)
+        return self._vote_matrix(people, pairs, results)
+    
+    def _pairs(self, person_ids):
+        # Returns the distinct people, in order, and each unordered pair
+        people = []
+        for person_id in person_ids:
+            if person_id not in people:
+                people.append(person_id)
+        return people, [(person1, person2) for i, person1 \
+            in enumerate(people) for person2 in people[i + 1:]]
+    
+    def _vote_matrix(self, people, pairs, results):
+        # Builds a VoteMatrix from the BatchResult of comparing each pair
+        comparisons = {}
+        errors = {}
+        for pair, result in zip(pairs, results):
+            if result.ok:
+                comparisons[pair] = result.results
+            else:
+                errors[pair] = result.error
+        return agreement.VoteMatrix.from_comparisons(people, comparisons, \
+            errors)
     
     def users_supporting_person_are_also(self, person_id, *args, **kwargs):
         """
@@ -196,8 +565,8 @@ class Api(object):
         }
         
         """
-        return calls.UsersSupportingPersonAreAlso(self.key, person_id, *args, \
-            **kwargs).results
+        return self._call(calls.UsersSupportingPersonAreAlso, person_id, \
+            *args, **kwargs)
     
     def users_opposing_person_are_also(self, person_id, *args, **kwargs):
         """
@@ -238,8 +607,8 @@ class Api(object):
         }
         
         """
-        return calls.UsersOpposingPersonAreAlso(self.key, person_id, *args, \
-            **kwargs).results
+        return self._call(calls.UsersOpposingPersonAreAlso, person_id, \
+            *args, **kwargs)
     
     
     def users_tracking_person_are_also(self, person_id, *args, **kwargs):
@@ -271,8 +640,8 @@ class Api(object):
         }
         
         """
-        return calls.UsersTrackingPersonAreAlso(self.key, person_id, *args, \
-            **kwargs).results
+        return self._call(calls.UsersTrackingPersonAreAlso, person_id, \
+            *args, **kwargs)
     
     
     def bills(self, *args, **kwargs):
@@ -301,7 +670,25 @@ class Api(object):
         number = An integer specifying a bill's number
         
         """
-        return calls.Bills(self.key, *args, **kwargs).results
+        return self._call(calls.Bills, *args, **kwargs)
+    
+    def iter_bills(self, *args, **kwargs):
+        """
+        Like bills(), but returns an iterator that yields each bill as soon as
+        it has been read from the response, without holding the whole
+        response in memory. Accepts the same keyword arguments as bills().
+        
+        Usage
+        =====
+        >>> for bill in api.iter_bills(congress=111):
+        ...     print bill
+        
+        Returns
+        =======
+        <generator of OpenCongress Bill objects>
+        
+        """
+        return self._iter(calls.Bills, *args, **kwargs)
     
     def bills_by_ident(self, *args, **kwargs):
         """
@@ -322,8 +709,18 @@ class Api(object):
             <OpenCongress Bill object (111-h3962)>
         ]
         
+        The list is in the order of the idents, with duplicates dropped. Its
+        missing attribute lists the idents that matched no bill. Long lists
+        of idents are split into several requests, made concurrently.
+        
+        Keyword arguments
+        =================
+        max_workers = An integer specifying how many requests may be made at
+            once. Defaults to the size of the connection pool.
+        
         """
-        return calls.BillsByIdent(self.key, *args, **kwargs).results
+        kwargs.setdefault('max_workers', self.pool.maxsize)
+        return self._call(calls.BillsByIdent, *args, **kwargs)
     
     def bills_introduced_since(self, date_from, *args, **kwargs):
         """
@@ -347,7 +744,7 @@ class Api(object):
         
         """
         kwargs['date'] = url_date(date_from)
-        return calls.BillsIntroducedSince(self.key, *args, **kwargs).results
+        return self._call(calls.BillsIntroducedSince, *args, **kwargs)
     
     def bills_by_query(self, query, *args, **kwargs):
         """
@@ -357,9 +754,16 @@ class Api(object):
         =========
         query = A string to search by
         
+        Keyword arguments
+        =================
+        local = A boolean. If True, searches this Api's search_index instead
+            of OpenCongress.org. Local queries may quote phrases and end
+            words with * to match by prefix.
+        
         Usage
         =====
         >>> api.bills_by_query('poverty')
+        >>> api.bills_by_query('"global poverty" act*', local=True)
         
         Returns
         =======
@@ -368,8 +772,12 @@ class Api(object):
         ]
         
         """
+        if kwargs.pop('local', False):
+            if self.search_index is None:
+                raise exceptions.ArgumentError('No search_index to query')
+            return self.search_index.search(query)
         kwargs['q'] = query
-        return calls.BillsByQuery(self.key, *args, **kwargs).results
+        return self._call(calls.BillsByQuery, *args, **kwargs)
     
     def hot_bills(self):
         """
@@ -386,7 +794,7 @@ class Api(object):
         ]
         
         """
-        return calls.HotBills(self.key).results
+        return self._call(calls.HotBills)
     
     def most_blogged_bills_this_week(self):
         """
@@ -403,7 +811,7 @@ class Api(object):
         ]
         
         """
-        return calls.MostBloggedBillsThisWeek(self.key).results
+        return self._call(calls.MostBloggedBillsThisWeek)
     
     def bills_in_the_news_this_week(self):
         """
@@ -420,7 +828,7 @@ class Api(object):
         ]
         
         """
-        return calls.BillsInTheNewsThisWeek(self.key).results
+        return self._call(calls.BillsInTheNewsThisWeek)
     
     def most_tracked_bills_this_week(self):
         """
@@ -438,7 +846,7 @@ class Api(object):
         ]
         
         """
-        return calls.MostTrackedBillsThisWeek(self.key).results
+        return self._call(calls.MostTrackedBillsThisWeek)
     
     def most_supported_bills_this_week(self):
         """
@@ -456,7 +864,7 @@ class Api(object):
         ]
         
         """
-        return calls.MostSupportedBillsThisWeek(self.key).results
+        return self._call(calls.MostSupportedBillsThisWeek)
     
     def most_opposed_bills_this_week(self):
         """
@@ -474,7 +882,7 @@ class Api(object):
         ]
         
         """
-        return calls.MostOpposedBillsThisWeek(self.key).results
+        return self._call(calls.MostOpposedBillsThisWeek)
     
     def users_supporting_bills_are_also(self, bill_id, *args, **kwargs):
         """
@@ -526,8 +934,8 @@ class Api(object):
         }
         
         """
-        return calls.UsersSupportingBillAreAlso(self.key, bill_id, *args, \
-            **kwargs).results
+        return self._call(calls.UsersSupportingBillAreAlso, bill_id, \
+            *args, **kwargs)
     
     def users_tracking_bills_are_also_tracking(self, bill_id, *args, **kwargs):
         """
@@ -579,8 +987,8 @@ class Api(object):
         }
         
         """
-        return calls.UsersTrackingBillAreAlsoTracking(self.key, bill_id, \
-            *args, **kwargs).results
+        return self._call(calls.UsersTrackingBillAreAlsoTracking, bill_id, \
+            *args, **kwargs)
     
     def issues(self, keyword, *args, **kwargs):
         """
@@ -602,7 +1010,7 @@ class Api(object):
         
         """
         kwargs['keyword'] = keyword
-        return calls.Issues(self.key, keyword, *args, **kwargs).results
+        return self._call(calls.Issues, keyword, *args, **kwargs)
     
     def battle_royale(self, search_type, *args, **kwargs):
         """
@@ -646,5 +1054,45 @@ class Api(object):
                     p_approval_avg' (average approval rating)
         
         """
-        return calls.BattleRoyale(self.key, search_type, *args, \
-            **kwargs).results
\ No newline at end of file
+        return self._call(calls.BattleRoyale, search_type, *args, \
+            **kwargs)
+    
+    def iter_battle_royale(self, search_type, *args, **kwargs):
+        """
+        Like battle_royale(), but walks every page of results in turn,
+        starting from the page keyword argument (1 by default) and stopping
+        at the first empty page. The next pages are fetched in the background
+        while the current one is consumed.
+        
+        Usage
+        =====
+        >>> results = api.iter_battle_royale('bills', timeframe='30days')
+        >>> for bill in results:
+        ...     print bill
+        >>> results.stats()
+        
+        Returns
+        =======
+        <opencongress.paging.PageIterator object>, whose stats() method
+        returns {'pages': 12, 'waited': 0.8}
+        
+        Keyword arguments
+        =================
+        prefetch = An integer specifying how many pages to fetch ahead of the
+            one being consumed. Defaults to 2.
+        
+        The remaining arguments are those of battle_royale().
+        
+        """
+        prefetch = kwargs.pop('prefetch', 2)
+        page = kwargs.pop('page', 1)
+        # Validate the arguments up front rather than on a background thread
+        calls.BattleRoyale(self.key, search_type, *args, \
+            **dict(kwargs, fetch=False))
+        
+        def fetch(page):
+            return self.battle_royale(search_type, *args, \
+                **dict(kwargs, page=page))
+        return paging.PageIterator(fetch, page, prefetch)
+
+from opencongress.asyncapi import AsyncApi
@@ -0,0 +1,104 @@
+YEA = 1
+NAY = -1
+ABSENT = 0
+
+# Vote values, as found in a Vote's person1/person2, and their positions.
+# Anything else (not voting, present) counts as absent.
+POSITIONS = {
+    '+': YEA,
+    'aye': YEA,
+    'yea': YEA,
+    'yes': YEA,
+    '-': NAY,
+    'nay': NAY,
+    'no': NAY,
+}
+
+
+def position(value):
+    """
+    Returns the position (YEA, NAY or ABSENT) a vote value stands for.
+    """
+    if value is None:
+        return ABSENT
+    return POSITIONS.get(value.strip().lower(), ABSENT)
+
+
+def roll_call_key(vote):
+    try:
+        return vote.roll_call.id
+    except AttributeError:
+        return vote.roll_call_name
+
+
+class VoteMatrix(object):
+    """
+    The positions of several people on the roll calls they voted on, as an
+    int8 matrix with a row per person and a column per roll call: YEA (1),
+    NAY (-1) or ABSENT (0). Requires NumPy.
+
+    Attributes
+    ==========
+    people = The person IDs, in row order
+    roll_calls = The roll call IDs, in column order
+    votes = The int8 NumPy matrix of positions
+    errors = A dictionary mapping each (person1, person2) pair that could
+        not be compared to its exception
+
+    """
+
+    def __init__(self, people, roll_calls, votes, errors=None):
+        self.people = people
+        self.roll_calls = roll_calls
+        self.votes = votes
+        self.errors = errors or {}
+
+    @classmethod
+    def from_comparisons(cls, people, comparisons, errors=None):
+        """
+        Builds a matrix from compare_two_people() results. comparisons maps
+        (person1, person2) pairs to their results.
+        """
+        import numpy
+        rows = dict((person, i) for i, person in enumerate(people))
+        columns = {}
+        cells = {}
+        for (person1, person2), results in comparisons.items():
+            for vote in results['hot_votes'] + results['other_votes']:
+                key = roll_call_key(vote)
+                column = columns.setdefault(key, len(columns))
+                cells[rows[person1], column] = position(vote.person1)
+                cells[rows[person2], column] = position(vote.person2)
+        votes = numpy.zeros((len(people), len(columns)), dtype='int8')
+        if cells:
+            index = numpy.array(list(cells), dtype='intp')
+            votes[index[:, 0], index[:, 1]] = list(cells.values())
+        roll_calls = sorted(columns, key=columns.get)
+        return cls(list(people), roll_calls, votes, errors)
+
+    def agreement(self):
+        """
+        Returns a matrix of the share of roll calls on which each pair of
+        people voted the same way, out of those both voted on (NaN if they
+        have none in common).
+        """
+        import numpy
+        yea = (self.votes == YEA).astype('float64')
+        nay = (self.votes == NAY).astype('float64')
+        voted = yea + nay
+        together = voted.dot(voted.T)
+        agreed = yea.dot(yea.T) + nay.dot(nay.T)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return numpy.where(together > 0, agreed / together, numpy.nan)
+
+    def similarity(self):
+        """
+        Returns a matrix of the cosine similarity of each pair of people's
+        positions, where absences count as neither for nor against (NaN for
+        people who never voted).
+        """
+        import numpy
+        votes = self.votes.astype('float64')
+        norms = numpy.sqrt((votes * votes).sum(axis=1))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return votes.dot(votes.T) / numpy.outer(norms, norms)
@@ -0,0 +1,539 @@
+import asyncore, copy, functools, httplib, socket, StringIO, sys, time, \
+    urlparse
+from collections import deque
+
+from opencongress import Api, batch, calls, exceptions, search, \
+    transport
+
+
+class AsyncResult(object):
+    """
+    The pending result of a call made through an AsyncApi instance.
+    """
+    def __init__(self, api):
+        self._api = api
+        self._done = False
+        self._value = None
+        self._error = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self, timeout=None):
+        """
+        Runs the event loop until this call has finished, then returns its
+        results or raises its exception.
+        """
+        self._api.wait([self], timeout)
+        if not self._done:
+            raise socket.timeout('Call did not finish within %s seconds' % \
+                timeout)
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def exception(self):
+        return self._error
+
+    def add_done_callback(self, callback):
+        """
+        Arranges for callback(result) to be called once this call has
+        finished, or straight away if it already has.
+        """
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _finish(self, value=None, error=None):
+        self._value = value
+        self._error = error
+        self._done = True
+        for callback in self._callbacks:
+            callback(self)
+        self._callbacks = []
+
+
+class _Socket(object):
+    """
+    Lets httplib.HTTPResponse parse a response that has already been read.
+    """
+    def __init__(self, data):
+        self._data = data
+
+    def makefile(self, *args, **kwargs):
+        return StringIO.StringIO(self._data)
+
+
+class HTTPDispatcher(asyncore.dispatcher):
+    """
+    A single non-blocking GET request. callback(response, error) is called
+    with a transport.BufferedResponse once the server closes the connection,
+    or with a socket.timeout if the connection has gone timeout seconds
+    without any activity.
+    """
+    def __init__(self, address, host, path, headers, callback, map, \
+                 timeout=None):
+        asyncore.dispatcher.__init__(self, map=map)
+        self.callback = callback
+        self.outbuf = (
+            'GET %s HTTP/1.0\r\n'
+            'Host: %s\r\n'
+            'Accept-Encoding: gzip\r\n'
+            '%s'
+            '\r\n'
+        ) % (path, host, ''.join('%s: %s\r\n' % header \
+            for header in sorted((headers or {}).items())))
+        self.inbuf = []
+        self.timeout = timeout
+        self.last_activity = time.time()
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.connect(address)
+        except socket.error:
+            self.close()
+            raise
+
+    def writable(self):
+        return bool(self.outbuf)
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+        sent = self.send(self.outbuf)
+        self.outbuf = self.outbuf[sent:]
+        self.last_activity = time.time()
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if data:
+            self.inbuf.append(data)
+            self.last_activity = time.time()
+
+    def check_timeout(self, now):
+        # Called by the event loop, since asyncore has no timeouts of its own
+        if self.timeout is not None and \
+                now - self.last_activity >= self.timeout:
+            self.close()
+            self._done(None, socket.timeout('timed out'))
+
+    def handle_close(self):
+        self.close()
+        if self.callback is None:
+            return
+        try:
+            raw = httplib.HTTPResponse(_Socket(''.join(self.inbuf)))
+            raw.begin()
+            response = transport.BufferedResponse(raw.status, \
+                dict(raw.getheaders()), raw.read())
+        except httplib.HTTPException as e:
+            self._done(None, e)
+        else:
+            self._done(response, None)
+
+    def handle_error(self):
+        self.close()
+        self._done(None, sys.exc_info()[1])
+
+    def _done(self, response, error):
+        callback, self.callback = self.callback, None
+        if callback is not None:
+            callback(response, error)
+
+
+class _Flights(object):
+    """
+    cache.SingleFlight for the event loop: while a call for a key is in
+    flight, identical calls share its AsyncResult (as shallow copies of its
+    results) instead of sending a request of their own.
+    """
+    def __init__(self):
+        self._flights = {}
+        self._coalesced = 0
+
+    def join(self, key):
+        # Returns the AsyncResult in flight for key, or None
+        flight = self._flights.get(key)
+        if flight is not None:
+            self._coalesced += 1
+        return flight
+
+    def start(self, key, result):
+        self._flights[key] = result
+        result.add_done_callback(lambda result: self._flights.pop(key, None))
+
+    def stats(self):
+        return {
+            'in_flight': len(self._flights),
+            'coalesced': self._coalesced,
+        }
+
+
+class AsyncApi(Api):
+    """
+    A non-blocking interface to the OpenCongress.org API. Every method of
+    opencongress.Api is available and validates its arguments the same way,
+    but returns an AsyncResult straight away instead of blocking; requests
+    are carried out by an asyncore event loop driven by wait() or
+    AsyncResult.result().
+
+    >>> api = opencongress.AsyncApi('api_key_here')
+    >>> pending = [api.people(person_id=i) for i in person_ids]
+    >>> api.wait()
+    >>> [p.result() for p in pending]
+
+    Parameters
+    ==========
+    key = Your OpenCongress.org API key. Get one at
+        http://www.opencongress.org/api
+    max_connections = An integer specifying how many requests may be in
+        flight at once. Further calls are queued.
+    timeout = A float specifying how long, in seconds, a request may go
+        without any activity on its connection before it fails with
+        socket.timeout
+
+    The remaining keyword arguments are those of opencongress.Api, except
+    maxsize and throttle, which AsyncApi does not support; use
+    max_connections to limit the requests in flight. With coalesce, a call
+    made while an identical one is in flight shares its AsyncResult.
+
+    """
+
+    def __init__(self, key, max_connections=100, timeout=None, **kwargs):
+        if 'maxsize' in kwargs:
+            raise ValueError('AsyncApi does not support maxsize; use ' \
+                'max_connections')
+        super(AsyncApi, self).__init__(key, timeout=timeout, **kwargs)
+        if self.throttle is not None:
+            raise ValueError('AsyncApi does not support throttle')
+        if self.flights is not None:
+            self.flights = _Flights()
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.map = {}
+        self._queue = deque()
+        self._in_flight = 0
+        self._addresses = {}
+
+    def _call(self, call_class, *args, **kwargs):
+        kwargs['fetch'] = False
+        kwargs['cache'] = self.cache
+        kwargs['validators'] = self.validators
+        kwargs['lazy'] = self.lazy
+        call = call_class(self.key, *args, **kwargs)
+        result = AsyncResult(self)
+        if self.results_cache is not None:
+            results = self.results_cache.get(call.cache_key)
+            if results is not None:
+                result._finish(results)
+                return result
+        if self.flights is not None:
+            flight = self.flights.join(call.cache_key)
+            if flight is not None:
+                return self._then(flight, copy.copy)
+            self.flights.start(call.cache_key, result)
+        if self.results_cache is not None:
+            
+            def remember(result):
+                if result.exception() is None:
+                    self._remember(call)
+            result.add_done_callback(remember)
+        self._submit(call, result)
+        return result
+
+    def _iter(self, call_class, *args, **kwargs):
+        raise exceptions.ArgumentError('Streaming calls are not available ' \
+            'through AsyncApi')
+
+    def iter_battle_royale(self, search_type, *args, **kwargs):
+        # Pages are fetched on background threads, which can't drive the
+        # event loop
+        raise exceptions.ArgumentError('Paged iteration is not available ' \
+            'through AsyncApi; call battle_royale() for each page instead')
+
+    def pipeline(self, calls, *args, **kwargs):
+        # Fetches on a thread pool, outside the event loop
+        raise exceptions.ArgumentError('Pipelines are not available ' \
+            'through AsyncApi; call batch() instead')
+
+    def to_columns(self, method, *args, **kwargs):
+        raise exceptions.ArgumentError('Columns are not available through ' \
+            'AsyncApi; build them from an Api instead')
+
+    def to_records(self, method, *args, **kwargs):
+        raise exceptions.ArgumentError('Records are not available through ' \
+            'AsyncApi; build them from an Api instead')
+
+    def _then(self, result, function):
+        # Returns an AsyncResult finished with function(value) once result
+        # has finished with value, or with result's exception
+        chained = AsyncResult(self)
+
+        def finished(result):
+            if result.exception() is not None:
+                return chained._finish(error=result.exception())
+            try:
+                value = function(result.result())
+            except Exception as e:
+                return chained._finish(error=e)
+            chained._finish(value)
+        result.add_done_callback(finished)
+        return chained
+
+    def people(self, *args, **kwargs):
+        if not kwargs.pop('local', False):
+            return super(AsyncApi, self).people(*args, **kwargs)
+        if self.people_index is not None:
+            loaded = AsyncResult(self)
+            loaded._finish(self.people_index)
+        else:
+            def index(people):
+                if self.people_index is None:
+                    self.people_index = search.PeopleIndex(people)
+                return self.people_index
+            loaded = self._then(self._call(calls.People), index)
+        return self._then(loaded, lambda index: index.query(**kwargs))
+
+    def bills_by_query(self, query, *args, **kwargs):
+        if not kwargs.get('local'):
+            return super(AsyncApi, self).bills_by_query(query, *args, \
+                **kwargs)
+        # Answered from search_index straight away; a missing index or a bad
+        # query raises, as invalid arguments do
+        found = AsyncResult(self)
+        found._finish(super(AsyncApi, self).bills_by_query(query, *args, \
+            **kwargs))
+        return found
+
+    def batch(self, calls, max_workers=None, ordered=True):
+        """
+        Like Api.batch(), but sends the calls through the event loop, at most
+        max_workers at a time (max_connections by default), and returns
+        BatchResults holding their finished results. If ordered is False,
+        the returned iterator runs the event loop as it is consumed.
+        """
+        specs = [batch.parse_spec(spec) for spec in calls]
+
+        def call(method, args, kwargs):
+            return batch._method(self, method)(*args, **dict(kwargs))
+        pending = self._limited([functools.partial(call, *spec) \
+            for spec in specs], max_workers or self.max_connections)
+        if not ordered:
+            return self._as_completed(zip(specs, pending))
+        self.wait(pending)
+        return [_batch_result(spec, result) for spec, result \
+            in zip(specs, pending)]
+
+    def _as_completed(self, pending):
+        while pending:
+            finished = [item for item in pending if item[1].done()]
+            if not finished:
+                self.poll(0.05)
+            for item in finished:
+                pending.remove(item)
+                yield _batch_result(*item)
+
+    def compare_many(self, person_ids, max_workers=None):
+        people, pairs = self._pairs(person_ids)
+        pending = self._limited([functools.partial(self.compare_two_people, \
+            *pair) for pair in pairs], max_workers or self.max_connections)
+
+        def matrix(pending):
+            return self._vote_matrix(people, pairs, [_batch_result( \
+                ('compare_two_people', pair, {}), result) for pair, result \
+                in zip(pairs, pending)])
+        return self._when_all(pending, matrix)
+
+    def _limited(self, functions, limit):
+        # Calls each function, which returns an AsyncResult (or a value, for
+        # methods answered locally), keeping at most limit of them pending.
+        # Returns an AsyncResult for each function
+        proxies = [AsyncResult(self) for function in functions]
+        waiting = deque(zip(functions, proxies))
+        state = {'pending': 0, 'starting': False}
+
+        def finished(proxy, result):
+            state['pending'] -= 1
+            proxy._finish(result._value, result._error)
+            start()
+
+        def start():
+            # Calls that finish straight away, e.g. from the results cache,
+            # are picked up by the loop already running rather than by
+            # recursing
+            if state['starting']:
+                return
+            state['starting'] = True
+            try:
+                while waiting and state['pending'] < max(1, limit):
+                    function, proxy = waiting.popleft()
+                    state['pending'] += 1
+                    try:
+                        result = function()
+                    except Exception as e:
+                        result = AsyncResult(self)
+                        result._finish(error=e)
+                    if not isinstance(result, AsyncResult):
+                        value, result = result, AsyncResult(self)
+                        result._finish(value)
+                    result.add_done_callback(lambda result, proxy=proxy: \
+                        finished(proxy, result))
+            finally:
+                state['starting'] = False
+        start()
+        return proxies
+
+    def _when_all(self, results, function):
+        # Returns an AsyncResult finished with function(results) once every
+        # one of results has finished, whether or not it failed
+        combined = AsyncResult(self)
+
+        def finished(result):
+            if combined.done() or not all(r.done() for r in results):
+                return
+            try:
+                value = function(results)
+            except Exception as e:
+                return combined._finish(error=e)
+            combined._finish(value)
+        for result in results:
+            result.add_done_callback(finished)
+        if not results:
+            finished(None)
+        return combined
+
+    def poll(self, timeout=0.0):
+        """
+        Runs one pass of the event loop, waiting at most timeout seconds for
+        a socket to become ready.
+        """
+        if self.map:
+            asyncore.loop(timeout, map=self.map, count=1)
+            now = time.time()
+            for dispatcher in self.map.values():
+                dispatcher.check_timeout(now)
+        self._dispatch()
+
+    def wait(self, results=None, timeout=None):
+        """
+        Runs the event loop until every AsyncResult in results (or every
+        pending call, if results is None) has finished or timeout seconds
+        have passed.
+        """
+        deadline = timeout is not None and time.time() + timeout
+        while True:
+            if results is None:
+                if not self.map and not self._queue:
+                    return
+            elif all(result.done() for result in results):
+                return
+            if deadline and time.time() >= deadline:
+                return
+            self.poll(0.05)
+
+    def stats(self):
+        stats = super(AsyncApi, self).stats()
+        stats['async'] = {
+            'in_flight': self._in_flight,
+            'queued': len(self._queue),
+        }
+        return stats
+
+    def _submit(self, call, result):
+        if call.parts is not None:
+            return self._gather(call, result)
+        cached = call.cached_response()
+        if cached is not None:
+            self._complete(call, result, cached)
+        else:
+            self._queue.append((call, result))
+            self._dispatch()
+    
+    def _gather(self, call, result):
+        # Sends each part of a call made as several requests, and finishes
+        # result with their merged results once all of them have finished
+        pending = [AsyncResult(self) for part in call.parts]
+        
+        def finished(part_result):
+            if result.done():
+                return
+            if part_result.exception() is not None:
+                return result._finish(error=part_result.exception())
+            if not all(p.done() for p in pending):
+                return
+            try:
+                value = call.merge([p.result() for p in pending])
+            except Exception as e:
+                return result._finish(error=e)
+            result._finish(value)
+        for part, part_result in zip(call.parts, pending):
+            part_result.add_done_callback(finished)
+            self._submit(part, part_result)
+    
+    def _dispatch(self):
+        while self._queue and self._in_flight < self.max_connections:
+            call, result = self._queue.popleft()
+            self._in_flight += 1
+            try:
+                self._send(call, result)
+            except socket.error as e:
+                self._in_flight -= 1
+                result._finish(error=e)
+
+    def _send(self, call, result):
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(call.url)
+        if query:
+            path = '%s?%s' % (path, query)
+        entry = None
+        if call.validators is not None:
+            entry = call.validators.get(call.cache_key)
+
+        def callback(response, error):
+            self._in_flight -= 1
+            if error is None and entry and response.getcode() == 304:
+                # Unchanged since the results were last parsed
+                call.results = entry[1]
+                call.validators.not_modified()
+                return result._finish(call.results)
+            if error is None and response.getcode() != 200:
+                error = exceptions.HTTPError(response.getcode())
+            if error is not None:
+                return result._finish(error=error)
+            if call.cache is not None:
+                try:
+                    response = call.store(response)
+                except (IOError, OSError) as e:
+                    return result._finish(error=e)
+            self._complete(call, result, response)
+
+        HTTPDispatcher(self._address(netloc), netloc, path, \
+            entry and entry[0], callback, self.map, self.timeout)
+
+    def _complete(self, call, result, response):
+        try:
+            value = call.load(response)
+            if call.validators is not None:
+                call.validators.set(call.cache_key, response, value)
+        except Exception as e:
+            return result._finish(error=e)
+        finally:
+            response.close()
+        result._finish(value)
+
+    def _address(self, netloc):
+        # Resolve each host once; the lookup itself blocks
+        try:
+            return self._addresses[netloc]
+        except KeyError:
+            host, _, port = netloc.partition(':')
+            address = (socket.gethostbyname(host), int(port or 80))
+            self._addresses[netloc] = address
+            return address
+
+
+def _batch_result(spec, result):
+    method, args, kwargs = spec
+    return batch.BatchResult(method, args, kwargs, results=result._value, \
+        error=result._error)
@@ -0,0 +1,292 @@
+from multiprocessing.pool import ThreadPool
+import Queue, threading, time
+
+from opencongress import exceptions
+from opencongress.calls import ApiCall
+
+
+class BatchResult(object):
+    """
+    The outcome of one call made through Api.batch(). Exactly one of results
+    and error is set.
+    """
+    def __init__(self, method, args, kwargs, results=None, error=None):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.results = results
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<OpenCongress BatchResult object (%s: %s)>' % (
+            self.method,
+            'ok' if self.ok else repr(self.error),
+        )
+
+
+def parse_spec(spec):
+    """
+    Normalizes a batch call specification into a (method, args, kwargs)
+    tuple. A specification is a method name, optionally followed by a
+    sequence of positional arguments and/or a dictionary of keyword
+    arguments:
+
+    >>> parse_spec(('people', {'person_id': 300056}))
+    ('people', (), {'person_id': 300056})
+    >>> parse_spec(('bills_by_ident', ['111-h2454', '111-h3962']))
+    ('bills_by_ident', ('111-h2454', '111-h3962'), {})
+    """
+    if isinstance(spec, basestring):
+        return spec, (), {}
+    method, args, kwargs = spec[0], (), {}
+    for part in spec[1:]:
+        if isinstance(part, dict):
+            kwargs = part
+        else:
+            args = tuple(part)
+    return method, args, kwargs
+
+
+def _method(api, method):
+    # Returns api's method of that name, or raises ArgumentError if it isn't
+    # one a batch may call. Callers turn that into the BatchResult of the
+    # call in question, so that the rest of the batch still runs
+    if method.startswith('_') or not callable(getattr(api, method, None)):
+        raise exceptions.ArgumentError('Invalid batch method: "%s"' % \
+            method)
+    return getattr(api, method)
+
+
+def run(api, calls, max_workers=4, ordered=True):
+    """
+    Runs each call specification in calls against api on a pool of
+    max_workers threads. Returns a list of BatchResults in input order, or,
+    if ordered is False, an iterator that yields them as they complete.
+    """
+    specs = [parse_spec(spec) for spec in calls]
+
+    def call(spec):
+        method, args, kwargs = spec
+        try:
+            results = _method(api, method)(*args, **dict(kwargs))
+        except Exception as e:
+            return BatchResult(method, args, kwargs, error=e)
+        return BatchResult(method, args, kwargs, results=results)
+
+    workers = max(1, min(max_workers, len(specs)))
+    if not ordered:
+        return _as_completed(workers, call, specs)
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(call, specs)
+    finally:
+        pool.terminate()
+
+
+def _as_completed(workers, call, specs):
+    # The pool is only started once iteration begins, so that an iterator
+    # that is never consumed leaves no threads behind
+    pool = ThreadPool(workers)
+    try:
+        for result in pool.imap_unordered(call, specs):
+            yield result
+    finally:
+        pool.terminate()
+
+
+class Pipeline(object):
+    """
+    Runs call specifications through two stages connected by a bounded
+    queue: fetch_workers threads download raw responses, and parse_workers
+    threads decompress, parse and process them. Iterating yields a
+    BatchResult per call. See Api.pipeline().
+
+    The workers start when iteration does, and stop once the results are
+    exhausted or the iterator is closed or garbage collected.
+    """
+
+    def __init__(self, api, calls, fetch_workers=4, parse_workers=1, \
+                 queue_size=8, ordered=True):
+        self.api = api
+        self.ordered = ordered
+        # The workers share only the stages, never the Pipeline, so that an
+        # abandoned Pipeline can be collected and its workers stopped
+        self._stages = _Stages(api, [parse_spec(spec) \
+            for spec in calls], queue_size)
+        self._results = _run(self._stages, fetch_workers, parse_workers, \
+            ordered)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self._results)
+
+    def close(self):
+        """
+        Stops the workers, discarding any results not yet yielded.
+        """
+        self._results.close()
+
+    def stats(self):
+        """
+        Returns the time, in seconds, spent in each stage (summed over its
+        workers) and the wall time elapsed until the last result.
+        """
+        return self._stages.stats()
+
+
+def _run(stages, fetch_workers, parse_workers, ordered):
+    # A generator, so that nothing starts before the first result is asked
+    # for, and the finally clause stops the workers however iteration ends
+    stages.start(fetch_workers, parse_workers)
+    pending = {}
+    following = 0
+    try:
+        for i in range(len(stages.specs)):
+            index, result = stages.get(stages.done)
+            if not ordered:
+                yield result
+                continue
+            pending[index] = result
+            while following in pending:
+                yield pending.pop(following)
+                following += 1
+    finally:
+        stages.stop()
+
+
+class _Stages(object):
+    """
+    The queues and worker threads of a Pipeline.
+    """
+
+    # How often, in seconds, blocked workers check whether to give up
+    _poll_interval = 0.1
+
+    def __init__(self, api, specs, queue_size):
+        self.api = api
+        self.specs = specs
+        self._lock = threading.Lock()
+        self._fetch_time = 0.0
+        self._parse_time = 0.0
+        self._wall_time = 0.0
+        self._started = None
+
+        self._stop = threading.Event()
+        self._inbox = Queue.Queue()
+        for item in enumerate(specs):
+            self._inbox.put(item)
+        self._downloaded = Queue.Queue(max(1, queue_size))
+        self.done = Queue.Queue()
+
+    def start(self, fetch_workers, parse_workers):
+        self._started = time.time()
+        for i in range(max(1, fetch_workers)):
+            self._start(self._fetch_worker)
+        for i in range(max(1, parse_workers)):
+            self._start(self._parse_worker)
+
+    def stop(self):
+        with self._lock:
+            self._wall_time = time.time() - self._started
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'fetch_time': self._fetch_time,
+                'parse_time': self._parse_time,
+                'wall_time': self._wall_time,
+            }
+
+    def _start(self, target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def get(self, queue):
+        while True:
+            try:
+                return queue.get(timeout=self._poll_interval)
+            except Queue.Empty:
+                if self._stop.is_set():
+                    raise
+
+    def _put(self, queue, item):
+        while not self._stop.is_set():
+            try:
+                return queue.put(item, timeout=self._poll_interval)
+            except Queue.Full:
+                pass
+
+    def _fetch_worker(self):
+        while not self._stop.is_set():
+            try:
+                index, (method, args, kwargs) = self._inbox.get_nowait()
+            except Queue.Empty:
+                return
+            started = time.time()
+            try:
+                item = self._fetch(method, args, kwargs)
+            except Exception as e:
+                item = BatchResult(method, args, kwargs, error=e)
+            finally:
+                self._spent('_fetch_time', started)
+            if isinstance(item, BatchResult):
+                self._put(self.done, (index, item))
+            else:
+                self._put(self._downloaded, (index, method, args, kwargs) + \
+                    item)
+
+    def _fetch(self, method, args, kwargs):
+        # Returns a finished BatchResult, or a (call, response) tuple for the
+        # parse stage
+        _method(self.api, method)
+        call = self.api._build(method, *args, **dict(kwargs))
+        if not isinstance(call, ApiCall):
+            # Methods answered without a request, e.g. local searches
+            return BatchResult(method, args, kwargs, results=call)
+        if self.api.results_cache is not None:
+            results = self.api.results_cache.get(call.cache_key)
+            if results is not None:
+                return BatchResult(method, args, kwargs, results=results)
+        entry = None
+        if call.validators is not None:
+            entry = call.validators.get(call.cache_key)
+        response = call.download(call.open(entry and entry[0]))
+        if response.getcode() == 304:
+            call.validators.not_modified()
+            return BatchResult(method, args, kwargs, results=entry[1])
+        return call, response
+
+    def _parse_worker(self):
+        while True:
+            try:
+                index, method, args, kwargs, call, response = \
+                    self.get(self._downloaded)
+            except Queue.Empty:
+                return
+            started = time.time()
+            try:
+                results = call.load(response)
+                if call.validators is not None:
+                    call.validators.set(call.cache_key, response, results)
+                if self.api.results_cache is not None:
+                    self.api._remember(call)
+            except Exception as e:
+                result = BatchResult(method, args, kwargs, error=e)
+            else:
+                result = BatchResult(method, args, kwargs, results=results)
+            finally:
+                self._spent('_parse_time', started)
+            self._put(self.done, (index, result))
+
+    def _spent(self, stage, started):
+        with self._lock:
+            setattr(self, stage, getattr(self, stage) + time.time() - started)
@@ -0,0 +1,158 @@
+"""
+An on-disk store of bills for random access by ident, shared between
+processes through the OS page cache.
+
+The file holds each bill as a snapshot record (see opencongress.snapshot),
+sorted by ident, followed by an index: the offset of every record, and the
+sorted idents themselves. A BillStore maps the file into memory and binary
+searches the index in place, comparing idents through buffers over the
+mapping. Only the record of a bill that is looked up is decoded, read
+through a buffer as well, so that the only bytes copied out of the
+mapping are the values the bill is built from. Every process that opens
+the same file shares a single copy of its pages.
+
+>>> BillStore.build(api.bills(congress=111), '/var/lib/oc/111.bills')
+>>> store = BillStore('/var/lib/oc/111.bills')
+>>> store['111-h2454']
+<OpenCongress Bill object (H.R.2454 ...)>
+"""
+import mmap, struct
+
+from opencongress import exceptions, snapshot, utils
+from opencongress.calls import bill_ident
+
+
+MAGIC = 'OCBILLS'
+VERSION = 2
+
+# Magic, version, number of bills, offset of the index
+_HEADER = struct.Struct('<7sHIQ')
+
+
+class BillStore(object):
+    """
+    A read-only, memory-mapped store of bills, keyed by ident.
+
+    Parameters
+    ==========
+    path = A string specifying a file written by BillStore.build()
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error):
+                raise exceptions.ArgumentError('Not a bill store: %s' % path)
+        try:
+            magic, version, count, index = _HEADER.unpack_from(self._map)
+        except struct.error:
+            magic = version = None
+        if magic != MAGIC:
+            self._map.close()
+            raise exceptions.ArgumentError('Not a bill store: %s' % path)
+        if version != VERSION:
+            self._map.close()
+            raise exceptions.ArgumentError('Unsupported bill store ' \
+                'version: %s' % version)
+        self._count = count
+        # Offsets of the records, then of the idents, then the idents
+        self._record_offsets = index
+        self._ident_offsets = index + 8 * (count + 1)
+        self._idents = self._ident_offsets + 4 * (count + 1)
+
+    @classmethod
+    def build(cls, bills, path):
+        """
+        Writes bills to a new store at path, atomically replacing any
+        existing file. Of several bills with the same ident, the last wins.
+        """
+        by_ident = {}
+        for bill in bills:
+            by_ident[str(bill_ident(bill)).lower()] = bill
+        idents = sorted(by_ident)
+
+        def write(f):
+            f.write(_HEADER.pack(MAGIC, VERSION, len(idents), 0))
+            records = [_HEADER.size]
+            for ident in idents:
+                record = snapshot.encode([by_ident[ident]])
+                f.write(record)
+                records.append(records[-1] + len(record))
+            index = records[-1]
+            names = [0]
+            for ident in idents:
+                names.append(names[-1] + len(ident))
+            f.write(struct.pack('<%dQ' % len(records), *records))
+            f.write(struct.pack('<%dI' % len(names), *names))
+            f.write(''.join(idents))
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, VERSION, len(idents), index))
+        utils.write_atomically(path, write)
+        return cls(path)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, ident):
+        return self._find(ident) is not None
+
+    def __getitem__(self, ident):
+        i = self._find(ident)
+        if i is None:
+            raise KeyError(ident)
+        start, = struct.unpack_from('<Q', self._map, \
+            self._record_offsets + 8 * i)
+        return snapshot.decode(self._map, start)[0]
+
+    def get(self, ident, default=None):
+        """
+        Returns the bill with the passed ident (e.g. '111-h2454'), or
+        default.
+        """
+        try:
+            return self[ident]
+        except KeyError:
+            return default
+
+    def idents(self):
+        """
+        Yields every ident in the store, in sorted order.
+        """
+        for i in range(self._count):
+            yield str(self._ident(i))
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _ident(self, i):
+        # A buffer over the mapped ident, which compares by content with
+        # other buffers
+        start, end = struct.unpack_from('<2I', self._map, \
+            self._ident_offsets + 4 * i)
+        return buffer(self._map, self._idents + start, end - start)
+
+    def _find(self, ident):
+        # Binary search of the sorted idents, in place
+        ident = ident.lower()
+        if isinstance(ident, unicode):
+            ident = ident.encode('utf-8')
+        ident = buffer(ident)
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._ident(middle) < ident:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._ident(low) == ident:
+            return low
+        return None
@@ -0,0 +1,379 @@
+import copy, errno, hashlib, json, os, shutil, threading, time
+from collections import OrderedDict
+
+from opencongress import utils
+
+
+class DiskCache(object):
+    """
+    A persistent cache of raw API responses, stored one file per URL in a
+    local directory. Entries expire after a time-to-live chosen by the call
+    class that made the request (see ApiCall.cache_ttl()), and the least
+    recently used entries are evicted once the directory grows past
+    max_size bytes.
+
+    Writes go to a temporary file that is renamed into place, so several
+    processes can share the same directory safely.
+
+    >>> api = opencongress.Api('api_key_here', cache=DiskCache('/tmp/oc'))
+
+    Parameters
+    ==========
+    path = A string specifying the cache directory. It is created if it does
+        not exist.
+    max_size = An integer specifying the maximum total size of the cache, in
+        bytes. Defaults to 100MB.
+    ttls = A dictionary mapping call class names (e.g. 'HotBills') to a
+        time-to-live in seconds, overriding the class's own.
+
+    """
+
+    _suffix = '.cache'
+
+    # Bytes copied at a time by set_stream()
+    _chunk_size = 64 * 1024
+
+    def __init__(self, path, max_size=100 * 1024 * 1024, ttls=None):
+        self.path = path
+        self.max_size = max_size
+        self.ttls = ttls or {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def ttl(self, call):
+        """
+        Returns the time-to-live, in seconds, of responses to call.
+        """
+        try:
+            return self.ttls[call.__class__.__name__]
+        except KeyError:
+            return call.cache_ttl()
+
+    def get(self, key, ttl):
+        """
+        Returns a (headers, body) tuple for key, or None if there is no entry
+        younger than ttl seconds.
+        """
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                meta = json.loads(f.readline())
+                if meta['key'] != key or meta['created'] + ttl < time.time():
+                    raise ValueError
+                body = f.read()
+            # The modification time records when an entry was last used
+            os.utime(filename, None)
+        except (IOError, OSError, ValueError, KeyError):
+            self._count(hit=False)
+            return None
+        self._count(hit=True)
+        return meta['headers'], body
+
+    def set(self, key, headers, body):
+        """
+        Stores body (and a dictionary of its response headers) under key.
+        """
+        self._write(key, headers, lambda f: f.write(body))
+
+    def set_stream(self, key, headers, fp):
+        """
+        Like set(), but copies the body out of the file-like object fp chunk
+        by chunk, so that it is never held in memory whole. Returns a file
+        positioned at the start of the stored body, which stays readable
+        even if the entry is evicted meanwhile; the caller must close it.
+        """
+        return self._write(key, headers, \
+            lambda f: shutil.copyfileobj(fp, f, self._chunk_size), True)
+
+    def _write(self, key, headers, write_body, reopen=False):
+        meta = json.dumps({
+            'key': key,
+            'created': time.time(),
+            'headers': headers,
+        })
+
+        def write(f):
+            f.write(meta + '\n')
+            write_body(f)
+        # Reopened before the rename, so eviction can't remove it first
+        stored = utils.write_atomically(self._filename(key), write, reopen)
+        if stored is not None:
+            stored.readline()
+        self.evict()
+        return stored
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits within
+        max_size.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith(self._suffix):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        entries.sort()
+        while total > self.max_size and entries:
+            mtime, size, name = entries.pop(0)
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                # Already evicted by another process
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+        for name in os.listdir(self.path):
+            if name.endswith(self._suffix):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses}
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def _filename(self, key):
+        return os.path.join(self.path, hashlib.sha1(key).hexdigest() + \
+            self._suffix)
+
+
+class ResultCache(object):
+    """
+    An in-memory, least recently used cache of processed results (the lists
+    of Bill/Person/Issue objects and dictionaries that Api methods return),
+    so that hot endpoints are neither downloaded nor parsed again.
+
+    Entries are keyed by ApiCall.cache_key and expire after the call's
+    cache_ttl() unless a ttl is given here. Every lookup returns a shallow
+    copy of the cached list or dictionary, which the caller may add to or
+    remove from freely. The objects in it are shared with every other
+    lookup, so they must be treated as read-only: deep copies would cost
+    about as much as parsing the response again.
+
+    >>> api = opencongress.Api('api_key_here', results_cache=ResultCache())
+
+    Parameters
+    ==========
+    max_entries = An integer specifying the maximum number of cached results
+    max_bytes = An integer specifying the maximum total size, in bytes, of the
+        XML documents the cached results were parsed from. Unbounded by
+        default.
+    ttl = An integer specifying a time-to-live, in seconds, for every entry
+
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=None, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        """
+        Returns a copy of the results cached under key, or None.
+        """
+        with self._lock:
+            try:
+                expires, size, results = self._entries.pop(key)
+            except KeyError:
+                self._misses += 1
+                return None
+            if expires < time.time():
+                self._bytes -= size
+                self._misses += 1
+                return None
+            # Re-inserting moves the entry to the most recently used end
+            self._entries[key] = expires, size, results
+            self._hits += 1
+        return copy.copy(results)
+
+    def set(self, key, results, ttl, size=0):
+        """
+        Caches results under key for ttl seconds (or this cache's own ttl).
+        size is the length of the document they were parsed from.
+        """
+        if self.ttl is not None:
+            ttl = self.ttl
+        with self._lock:
+            try:
+                self._bytes -= self._entries.pop(key)[1]
+            except KeyError:
+                pass
+            self._entries[key] = time.time() + ttl, size, copy.copy(results)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or
+                    (self.max_bytes is not None and
+                     self._bytes > self.max_bytes)):
+                self._bytes -= self._entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+
+class ValidatorCache(object):
+    """
+    Remembers the ETag and Last-Modified validators of recent responses,
+    along with the results processed from them. Calls made through an Api
+    with a ValidatorCache send If-None-Match/If-Modified-Since headers, and
+    a 304 (Not Modified) response is answered from the remembered results
+    without downloading or parsing anything.
+
+    >>> api = opencongress.Api('api_key_here', validators=ValidatorCache())
+
+    Parameters
+    ==========
+    max_entries = An integer specifying the maximum number of URLs to
+        remember. The least recently used are forgotten first.
+
+    """
+
+    def __init__(self, max_entries=100):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._not_modified = 0
+
+    def get(self, key):
+        """
+        Returns a (headers, results) tuple for key, where headers are the
+        conditional request headers to send, or None.
+        """
+        with self._lock:
+            try:
+                headers, results = self._entries.pop(key)
+            except KeyError:
+                return None
+            self._entries[key] = headers, results
+        return headers, copy.copy(results)
+
+    def set(self, key, response, results):
+        """
+        Remembers the validators of response, if it has any, and the results
+        processed from it.
+        """
+        headers = {}
+        etag = response.getheader('etag')
+        if etag:
+            headers['If-None-Match'] = etag
+        last_modified = response.getheader('last-modified')
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        with self._lock:
+            self._entries.pop(key, None)
+            if not headers:
+                return
+            self._entries[key] = headers, copy.copy(results)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def not_modified(self):
+        with self._lock:
+            self._not_modified += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'not_modified': self._not_modified,
+            }
+
+
+class SingleFlight(object):
+    """
+    Collapses identical calls made at the same time into one. While a call
+    for a key is in flight, other threads asking for the same key wait for
+    it and share its results (as shallow copies, whose objects are shared
+    and read-only, as with ResultCache) or its exception, instead of making
+    a request of their own.
+
+    >>> flights = SingleFlight()
+    >>> flights.do(call.cache_key, call.fetch)
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._coalesced = 0
+
+    def do(self, key, function):
+        """
+        Returns function(), or the results of the call already in flight
+        for key.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.copy(flight.results)
+        try:
+            flight.results = function()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.results
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'coalesced': self._coalesced,
+            }
+
+
+class _Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
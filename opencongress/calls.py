@@ -1,8 +1,24 @@
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from xml.etree import ElementTree
-import urllib, urllib2, StringIO, gzip
+import itertools, urllib, urllib2, urlparse
 
 from opencongress.classes import Person, Bill, Issue, Vote
-from opencongress import utils, exceptions
+from opencongress import utils, exceptions, transport as _transport
+
+
+class _CountingReader(object):
+    """
+    Wraps a file-like object, counting the bytes read from it.
+    """
+    def __init__(self, fp):
+        self._fp = fp
+        self.count = 0
+    
+    def read(self, *args):
+        data = self._fp.read(*args)
+        self.count += len(data)
+        return data
 
 
 class ApiCall(object):
@@ -11,33 +27,213 @@ class ApiCall(object):
     _valid_values = None
     _url_postfix = None
     
+    # The tag and class of the elements a streaming call yields, for calls
+    # whose results are a flat list
+    _item_tag = None
+    _item_class = None
+    
+    # How long, in seconds, a response may be served from a DiskCache
+    _cache_ttl = 60 * 60
+    
+    # Calls sent as several requests keep a call per request here, and
+    # define merge(results) to combine the parts' results
+    parts = None
+    
+    # The length of the document the results were parsed from
+    size = 0
+    
     def __init__(self, key, *args, **kwargs):
         
+        # Connections are borrowed from the pool of the opencongress.Api
+        # instance making the call, if there is one
+        self.transport = kwargs.pop('transport', None) or \
+            _transport.default_pool
+        
+        # Calls constructed with fetch=False are validated but not sent until
+        # fetch() or iterresults() is called
+        fetch = kwargs.pop('fetch', True)
+        
+        # An optional opencongress.cache.DiskCache of raw responses
+        self.cache = kwargs.pop('cache', None)
+        
+        # An optional opencongress.cache.ValidatorCache, used to revalidate
+        # earlier results with a conditional request
+        self.validators = kwargs.pop('validators', None)
+        
+        # Whether result objects decode their fields on first access
+        self.lazy = kwargs.pop('lazy', False)
+        
         self.posargs = args
         self.urlargs = kwargs
         self.validate_args(kwargs)
         
         kwargs['key'] = key
         
-        req = urllib.urlopen(self.url)
+        if fetch:
+            self.fetch()
+    
+    def open(self, headers=None):
+        """
+        Sends the request and returns the response, raising HTTPError unless
+        it was successful. A 304 (Not Modified) response is returned as well
+        if conditional headers were passed. The caller is responsible for
+        closing it.
+        """
+        req = self.cached_response()
+        if req is not None:
+            return req
         
+        request_headers = {'Accept-Encoding': 'gzip'}
+        request_headers.update(headers or {})
+        req = self.transport.urlopen(self.url, request_headers)
+        if req.getcode() == 304 and headers:
+            return req
         if req.getcode() != 200:
+            req.close()
             raise exceptions.HTTPError(req.getcode())
         
-        # Decode gzipped data if it returns gzipped (it seems to happen
-        # intermittently)
+        if self.cache is not None:
+            return self.store(req)
+        return req
+    
+    @property
+    def cache_key(self):
+        """
+        The URL of this call without the API key, so that cached responses
+        can be shared between keys.
+        """
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(self.url)
+        # Sorted by name only: the order of a repeated parameter's values
+        # (e.g. ident[]) matters
+        query = sorted(((k, v) for k, v in urlparse.parse_qsl(query, True) \
+            if k != 'key'), key=lambda pair: pair[0])
+        return urlparse.urlunsplit((scheme, netloc, path, \
+            urllib.urlencode(query), ''))
+    
+    def cache_ttl(self):
+        return self._cache_ttl
+    
+    def cached_response(self):
+        """
+        Returns the cached response to this call, or None if there is no
+        cache or no fresh entry in it.
+        """
+        if self.cache is None:
+            return None
+        entry = self.cache.get(self.cache_key, self.cache.ttl(self))
+        if entry is None:
+            return None
+        headers, body = entry
+        return _transport.BufferedResponse(200, headers, body)
+    
+    def store(self, req):
+        """
+        Copies a successful response into the cache chunk by chunk and closes
+        it. Returns an equivalent response that reads the stored body back
+        from disk, so that the body is never held in memory whole.
+        """
         try:
-            if req.headers['content-encoding'] == 'gzip':
-                compressed = StringIO.StringIO(req.read())
-                unzipped = gzip.GzipFile(fileobj=compressed)
-                self.xml = ElementTree.fromstring(unzipped.read())
-            else:
-                self.xml = ElementTree.fromstring(req.read())
-        except KeyError:
-            self.xml = ElementTree.fromstring(req.read())
+            headers = _headers(req)
+            stored = self.cache.set_stream(self.cache_key, headers, req)
+        finally:
+            req.close()
+        return _transport.FileResponse(200, headers, stored)
+    
+    def download(self, req):
+        """
+        Reads an opened response to the end and closes it, releasing its
+        connection. Returns an equivalent transport.BufferedResponse holding
+        the raw, still compressed body.
+        """
+        if isinstance(req, _transport.BufferedResponse):
+            return req
+        try:
+            body = req.read()
+            headers = _headers(req)
+        finally:
+            req.close()
+        return _transport.BufferedResponse(req.getcode(), headers, body)
+    
+    def body(self, req):
+        """
+        Returns a file-like object that reads the XML document out of req.
+        """
+        # Gzipped responses are decompressed as they are read, straight into
+        # the parser
+        return _transport.DecodingReader(req)
+    
+    def fetch(self):
+        """
+        Sends the request, parses the response into self.xml and returns the
+        processed results (also available as self.results).
+        """
+        entry = None
+        if self.validators is not None:
+            entry = self.validators.get(self.cache_key)
+        
+        req = self.open(entry and entry[0])
+        try:
+            if req.getcode() == 304:
+                # Unchanged since the results were last parsed
+                self.results = entry[1]
+                self.validators.not_modified()
+                return self.results
+            self.load(req)
+        finally:
+            req.close()
         
-        req.close()
+        if self.validators is not None:
+            self.validators.set(self.cache_key, req, self.results)
+        return self.results
+    
+    def load(self, req):
+        """
+        Parses an already-opened response into self.xml and returns the
+        processed results (also available as self.results).
+        """
+        body = _CountingReader(self.body(req))
+        self.xml = ElementTree.parse(body).getroot()
+        self.size = body.count
         self.results = self.process()
+        return self.results
+    
+    def iterresults(self):
+        """
+        Sends the request and yields each result as soon as its element has
+        been read off the socket, discarding the element afterwards so that
+        memory use does not grow with the size of the response.
+        """
+        for elem in self.iterelements():
+            yield self._item_class(elem, self.lazy)
+    
+    def iterelements(self):
+        """
+        Like iterresults(), but yields the XML element of each result rather
+        than the object built from it. Each element is discarded once the
+        next one has been requested.
+        """
+        if self._item_tag is None:
+            raise exceptions.ArgumentError('%s results cannot be streamed' % \
+                self.__class__.__name__)
+        
+        req = self.open()
+        try:
+            depth = 0
+            root = None
+            events = ElementTree.iterparse(self.body(req), ('start', 'end'))
+            for event, elem in events:
+                if event == 'start':
+                    if root is None:
+                        root = elem
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth == 1:
+                    if elem.tag == self._item_tag:
+                        yield elem
+                    root.clear()
+        finally:
+            req.close()
     
     def validate_args(self, kwargs):
         if self._valid_kwargs:
@@ -103,28 +299,35 @@ class People(ApiCall):
         return 'http://www.opencongress.org/api/%s?%s' % (self._url_postfix, \
                urllib.urlencode(self.urlargs))
     
+    _item_tag = 'person'
+    _item_class = Person
+    
     def process(self):
-        return [Person(elem) for elem in self.xml.findall('person')]
+        return [Person(elem, self.lazy) for elem in self.xml.findall('person')]
 
 
 class SenatorsMostInTheNewsThisWeek(People):
     _url_postfix = 'senators_most_in_the_news_this_week'
     _valid_kwargs = None
+    _cache_ttl = 10 * 60
 
 
 class RepresentativesMostInTheNewsThisWeek(People):
     _url_postfix = 'representatives_most_in_the_news_this_week'
     _valid_kwargs = None
+    _cache_ttl = 10 * 60
 
 
 class MostBloggedSenatorsThisWeek(People):
     _url_postfix = 'most_blogged_senators_this_week'
     _valid_kwargs = None
+    _cache_ttl = 10 * 60
 
 
 class MostBloggedRepresentativesThisWeek(People):
     _url_postfix = 'most_blogged_representatives_this_week'
     _valid_kwargs = None
+    _cache_ttl = 10 * 60
 
 
 class CompareTwoPeople(ApiCall):
@@ -137,8 +340,10 @@ class CompareTwoPeople(ApiCall):
     
     def process(self, results={}):
         return {
-            'person1': Person(self.xml.find('person1').getchildren()[0]),
-            'person2': Person(self.xml.find('person2').getchildren()[0]),
+            'person1': Person(self.xml.find('person1').getchildren()[0], \
+                self.lazy),
+            'person2': Person(self.xml.find('person2').getchildren()[0], \
+                self.lazy),
             'hot_votes': [Vote(elem) for elem in \
                 self.xml.find('hot_votes').getchildren()],
             'other_votes': [Vote(elem) for elem in \
@@ -153,14 +358,78 @@ class Bills(ApiCall):
         'type': 'h s hj sj hc sc hr sr'.split()
     }
     
+    _item_tag = 'bill'
+    _item_class = Bill
+    
+    def cache_ttl(self):
+        # Bills from a past Congress no longer change much
+        try:
+            congress = int(self.urlargs['congress'])
+        except (KeyError, ValueError):
+            return self._cache_ttl
+        if congress < utils.current_congress():
+            return 30 * 24 * 60 * 60
+        return self._cache_ttl
+    
     def process(self):
-        return [Bill(elem) for elem in self.xml.findall('bill')]
+        return [Bill(elem, self.lazy) for elem in self.xml.findall('bill')]
+
+
+class IdentResults(list):
+    """
+    The bills matching a list of idents, in the order they were asked for.
+    missing lists the idents that matched no bill.
+    """
+    def __init__(self, bills=(), missing=()):
+        super(IdentResults, self).__init__(bills)
+        self.missing = list(missing)
+    
+    def __copy__(self):
+        # Copies of cached results must not share the missing list
+        return IdentResults(self, self.missing)
+
+
+def bill_ident(bill):
+    """
+    Returns a bill's OpenCongress ident, e.g. '111-h2454'.
+    """
+    try:
+        return bill.ident
+    except AttributeError:
+        return '%s-%s%s' % (bill.session, bill.bill_type, bill.number)
 
 
 class BillsByIdent(Bills):
+    """
+    Bills matching a list of idents, in the order of the idents, with
+    duplicates dropped. Lists too long for one request are split into parts
+    (see chunks()) whose results are merged; the parts are downloaded
+    concurrently, on up to max_workers threads.
+    """
     _url_postfix = 'bills_by_ident'
     _valid_kwargs = None
     
+    # The longest list of ident[]= parameters sent in one request. Longer
+    # lists are split into chunks (see chunks()) to keep URLs well within
+    # server limits
+    _max_idents_length = 1500
+    
+    def __init__(self, key, *idents, **kwargs):
+        unique = []
+        seen = set()
+        for ident in idents:
+            if ident.lower() not in seen:
+                seen.add(ident.lower())
+                unique.append(ident)
+        self.max_workers = kwargs.pop('max_workers', 4)
+        chunks = list(self.chunks(unique))
+        if len(chunks) > 1:
+            self.parts = [self.__class__(key, *chunk, \
+                **dict(kwargs, fetch=False)) for chunk in chunks]
+            # Each part revalidates its own request
+            kwargs['validators'] = None
+        super(BillsByIdent, self).__init__(key, *unique, **kwargs)
+    
     @property
     def url(self):
         return 'http://www.opencongress.org/api/%s?%s&%s' % (
@@ -168,6 +437,134 @@ class BillsByIdent(Bills):
             urllib.urlencode(self.urlargs),
             '&'.join(['ident[]=%s' % ident for ident in self.posargs]),
         )
+    
+    @classmethod
+    def chunks(cls, idents):
+        """
+        Splits idents into lists small enough to send in one request each.
+        """
+        chunk, length = [], 0
+        for ident in idents:
+            size = len('ident[]=&') + len(ident)
+            if chunk and length + size > cls._max_idents_length:
+                yield chunk
+                chunk, length = [], 0
+            chunk.append(ident)
+            length += size
+        if chunk:
+            yield chunk
+    
+    def open(self, headers=None):
+        if self.parts is None:
+            return super(BillsByIdent, self).open(headers)
+        pool = ThreadPool(max(1, min(self.max_workers, len(self.parts))))
+        try:
+            return _PartResponses(pool.map(_download_part, self.parts))
+        finally:
+            pool.terminate()
+    
+    def download(self, req):
+        if self.parts is None:
+            return super(BillsByIdent, self).download(req)
+        return req
+    
+    def load(self, req):
+        if self.parts is None:
+            return super(BillsByIdent, self).load(req)
+        return self.merge([_load_part(part, entry, response) \
+            for part, entry, response in req.parts])
+    
+    def iterelements(self):
+        if self.parts is None:
+            return super(BillsByIdent, self).iterelements()
+        return itertools.chain.from_iterable(part.iterelements() \
+            for part in self.parts)
+    
+    def process(self):
+        return merge_idents(self.posargs, \
+            super(BillsByIdent, self).process())
+    
+    def merge(self, results):
+        """
+        Combines the results of this call's parts, in order, into its own
+        results (also available as self.results).
+        """
+        self.size = sum(part.size for part in self.parts)
+        self.results = merge_idents(self.posargs, \
+            [bill for bills in results for bill in bills])
+        return self.results
+
+
+class _PartResponses(object):
+    """
+    The downloaded responses to the parts of a call, as a single response.
+    """
+    status = 200
+    
+    def __init__(self, parts):
+        self.parts = parts
+    
+    def getcode(self):
+        return self.status
+    
+    def getheader(self, name, default=None):
+        return default
+    
+    def close(self):
+        pass
+
+
+def _download_part(part):
+    # Returns the part, its validators entry and its downloaded response
+    entry = None
+    if part.validators is not None:
+        entry = part.validators.get(part.cache_key)
+    return part, entry, part.download(part.open(entry and entry[0]))
+
+
+def _load_part(part, entry, response):
+    if response.getcode() == 304:
+        part.validators.not_modified()
+        part.results = entry[1]
+        return part.results
+    results = part.load(response)
+    if part.validators is not None:
+        part.validators.set(part.cache_key, response, results)
+    return results
+
+
+def _headers(req):
+    # The response headers worth keeping with a stored body
+    headers = {}
+    for name in ('content-encoding', 'etag', 'last-modified'):
+        value = req.getheader(name)
+        if value:
+            headers[name] = value
+    return headers
+
+
+def merge_idents(idents, bills):
+    """
+    Orders bills by their position in idents, returning an IdentResults.
+    Bills whose ident was not asked for come last.
+    """
+    by_ident = OrderedDict()
+    extra = []
+    for bill in bills:
+        ident = str(bill_ident(bill)).lower()
+        if ident in by_ident:
+            extra.append(bill)
+        else:
+            by_ident[ident] = bill
+    results = IdentResults()
+    for ident in idents:
+        try:
+            results.append(by_ident.pop(ident.lower()))
+        except KeyError:
+            results.missing.append(ident)
+    results.extend(by_ident.values())
+    results.extend(extra)
+    return results
 
 
 class BillsIntroducedSince(Bills):
@@ -183,31 +580,37 @@ class BillsByQuery(Bills):
 class HotBills(Bills):
     _url_postfix = 'hot_bills'
     _valid_kwargs = None
+    _cache_ttl = 10 * 60
 
 
 class MostBloggedBillsThisWeek(Bills):
     _url_postfix = 'most_blogged_bills_this_week'
     _valid_kwargs = None
+    _cache_ttl = 10 * 60
 
 
 class BillsInTheNewsThisWeek(Bills):
     _url_postfix = 'bills_in_the_news_this_week'
     _valid_kwargs = None
+    _cache_ttl = 10 * 60
 
 
 class MostTrackedBillsThisWeek(Bills):
     _url_postfix = 'most_tracked_bills_this_week'
     _valid_kwargs = None
+    _cache_ttl = 10 * 60
 
 
 class MostSupportedBillsThisWeek(Bills):
     _url_postfix = 'most_supported_bills_this_week'
     _valid_kwargs = None
+    _cache_ttl = 10 * 60
 
 
 class MostOpposedBillsThisWeek(Bills):
     _url_postfix = 'most_opposed_bills_this_week'
     _valid_kwargs = None
+    _cache_ttl = 10 * 60
 
 
 class MixedResultSet(ApiCall):
@@ -220,9 +623,11 @@ class MixedResultSet(ApiCall):
             urllib.urlencode(self.urlargs)
         )
     
-    def process(self, results={}):
+    def process(self):
+        results = {}
         for result_set in self.xml.getchildren():
-            results[result_set.tag] = utils.parse_mixed_result(result_set)
+            results[result_set.tag] = utils.parse_mixed_result(result_set, \
+                lazy=self.lazy)
         return results
 
     
@@ -254,8 +659,11 @@ class Issues(ApiCall):
     _url_postfix = 'issues_by_keyword'
     _valid_kwargs = 'keyword'.split()
     
+    _item_tag = 'subject'
+    _item_class = Issue
+    
     def process(self):
-        return [Issue(elem) for elem in self.xml.findall('subject')]
+        return [Issue(elem, self.lazy) for elem in self.xml.findall('subject')]
 
 
 class BattleRoyale(ApiCall):
@@ -271,15 +679,15 @@ class BattleRoyale(ApiCall):
         super(BattleRoyale, self).__init__(key, *args, **kwargs)
     
     def validate_args(self, kwargs):
-        try:            
-            if self._search_type == 'bills':
-                self._valid_values['sort'] += \
-                    'vote_count_1 current_support_pb'.split()
-            if self._search_type in ['senators', 'representatives']:
-                self._valid_values['sort'] += \
-                    'p_approval_count p_approval_avg'.split()
-        except KeyError:
-            pass
+        # Extend a per-instance copy of the sort values, so that concurrent
+        # calls with different search types don't see each other's values
+        self._valid_values = dict(self._valid_values)
+        if self._search_type == 'bills':
+            self._valid_values['sort'] = self._valid_values['sort'] + \
+                'vote_count_1 current_support_pb'.split()
+        if self._search_type in ['senators', 'representatives']:
+            self._valid_values['sort'] = self._valid_values['sort'] + \
+                'p_approval_count p_approval_avg'.split()
         super(BattleRoyale, self).validate_args(kwargs)
     
     @property
@@ -294,8 +702,10 @@ class BattleRoyale(ApiCall):
     
     def process(self):
         if self._search_type == 'bills':
-            return [Bill(elem) for elem in self.xml.findall('bill')]
+            return [Bill(elem, self.lazy) for elem in self.xml.findall('bill')]
         elif self._search_type in ['senators', 'representatives']:
-            return [Person(elem) for elem in self.xml.findall('person')]
+            return [Person(elem, self.lazy) for elem in \
+                self.xml.findall('person')]
         elif self._search_type == 'issues':
-            return [Issue(elem) for elem in self.xml.findall('subject')]
\ No newline at end of file
+            return [Issue(elem, self.lazy) for elem in \
+                self.xml.findall('subject')]
\ No newline at end of file
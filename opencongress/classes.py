@@ -1,14 +1,100 @@
-from datetime import date, datetime
-import re
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime, timedelta, tzinfo
 
 class BaseNode(object):
     """
     Base object that all nodes inherit from, constructed by parsing an
     ElementTree node.
+    
+    Subclasses may declare the fields they expect in __slots__, so that
+    instances don't carry a per-instance __dict__. Child tags that aren't
+    declared are kept in an overflow mapping; either way they read as plain
+    attributes.
+    
+    If lazy is True, children are not deserialized up front: the node keeps
+    a reference to each child element and decodes it the first time its
+    attribute is read.
     """
-    def __init__(self, elem):
+    __slots__ = ('_extra', '_pending')
+    
+    def __init__(self, elem, lazy=False):
+        self._extra = None
+        self._pending = None
+        if lazy:
+            self._pending = dict((prop.tag.replace('-', '_'), prop) \
+                for prop in elem)
+            return
         for prop in elem.getchildren():
-            setattr(self, prop.tag.replace('-', '_'), deserialize(prop))
+            self._store(prop.tag.replace('-', '_'), self._decode(prop))
+    
+    def _decode(self, prop):
+        return deserialize(prop)
+    
+    def _store(self, name, value):
+        try:
+            object.__setattr__(self, name, value)
+        except AttributeError:
+            if self._extra is None:
+                object.__setattr__(self, '_extra', {})
+            self._extra[name] = value
+    
+    __setattr__ = _store
+    
+    def __getattr__(self, name):
+        # Only called once normal lookup has failed
+        if name not in ('_extra', '_pending'):
+            try:
+                return self._extra[name]
+            except (KeyError, TypeError):
+                pass
+            try:
+                prop = self._pending[name]
+            except (KeyError, TypeError):
+                pass
+            else:
+                value = self._decode(prop)
+                self._store(name, value)
+                self._pending.pop(name, None)
+                return value
+        raise AttributeError("'%s' object has no attribute '%s'" % (
+            self.__class__.__name__,
+            name,
+        ))
+    
+    def _fields(self):
+        names = set(self._pending or ())
+        for cls in self.__class__.__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name not in ('_extra', '_pending'):
+                    try:
+                        object.__getattribute__(self, name)
+                    except AttributeError:
+                        continue
+                    names.add(name)
+        names.update(self._extra or ())
+        return names
+    
+    @property
+    def __dict__(self):
+        """
+        The node's attributes, collected into a new dictionary. Decodes any
+        fields of a lazy node that haven't been read yet.
+        """
+        return dict((name, getattr(self, name)) for name in self._fields())
+    
+    def __dir__(self):
+        # Lists fields without decoding them
+        return sorted(set(dir(self.__class__)) | self._fields())
+    
+    def __getstate__(self):
+        return self.__dict__
+    
+    def __setstate__(self, state):
+        self._extra = None
+        self._pending = None
+        for name, value in state.items():
+            self._store(name, value)
     
     def __repr__(self):
         return '<OpenCongress %s object (%s)>' % (
@@ -21,6 +107,19 @@ class Person(BaseNode):
     """
     An object representing a senator or representative.
     """
+    __slots__ = (
+        'id', 'person_id', 'name', 'title', 'firstname', 'middlename',
+        'lastname', 'nickname', 'unaccented_name', 'gender', 'birthday',
+        'religion', 'party', 'state', 'district', 'url', 'email', 'phone',
+        'fax', 'website', 'webform', 'congress_office', 'bioguideid', 'osid',
+        'youtube_id', 'metavid_id', 'watchdog_id', 'sunlight_nickname',
+        'user_approval', 'fti_names', 'recent_news', 'recent_blogs',
+        'person_stats', 'roles', 'with_party_percentage',
+        'abstains_percentage', 'votes_democratic_position',
+        'votes_republican_position', 'bookmark_count_1', 'total_comments',
+        'p_approval_count', 'p_approval_avg',
+    )
+    
     def __str__(self):
         return self.name
 
@@ -29,6 +128,8 @@ class Commentary(BaseNode):
     """
     An object representing a news item or blog post.
     """
+    __slots__ = ()
+    
     def __str__(self):
         return self.title
 
@@ -37,6 +138,19 @@ class Bill(BaseNode):
     """
     An object representing a bill.
     """
+    __slots__ = (
+        'id', 'ident', 'bill_type', 'number', 'session', 'title_full_common',
+        'title_common', 'title_official', 'manual_title', 'status',
+        'introduced', 'last_action_at', 'lastaction', 'topresident_date',
+        'topresident_datetime', 'updated', 'hot_bill_category_id',
+        'key_vote_category_id', 'is_major', 'page_views_count', 'sponsor_id',
+        'sponsor', 'co_sponsors', 'summary', 'plain_language_summary',
+        'fti_titles', 'bill_titles', 'most_recent_actions', 'recent_news',
+        'recent_blogs', 'news_article_count', 'blog_article_count',
+        'bookmark_count_1', 'total_comments', 'vote_count_1',
+        'current_support_pb', 'support_count_1',
+    )
+    
     def __str__(self):
         try:
             return self.title_full_common
@@ -48,6 +162,14 @@ class RollCall(BaseNode):
     """
     An object representing a roll call (results of a vote).
     """
+    __slots__ = (
+        'id', 'number', 'question', 'result', 'required', 'roll_type',
+        'where', 'date', 'bill_id', 'amendment_id', 'ayes', 'nays',
+        'abstains', 'presents', 'title', 'filename', 'is_hot', 'hot_date',
+        'democratic_position', 'republican_position', 'created_at',
+        'updated_at',
+    )
+    
     def __str__(self):
         return self.question
 
@@ -56,6 +178,8 @@ class Issue(BaseNode):
     """
     An object representing a political issue.
     """
+    __slots__ = ()
+    
     def __str__(self):
         return self.term
 
@@ -65,119 +189,321 @@ class Vote(BaseNode):
     An object representing the results of a vote: a roll call and individual
     persons' votes.
     """
-    def __init__(self, elem):
-        for prop in elem.getchildren():
-            name = prop.tag.replace('-', '_')
-            if prop.tag.startswith('person'):
-                setattr(self, name, prop.getchildren()[0].text)
-            elif prop.tag == 'roll-call':
-                roll_call = RollCall(prop)
-                setattr(self, name, roll_call)
-                self.roll_call_name = str(roll_call)
-            else:
-                setattr(self, name, deserialize(prop))
+    __slots__ = ('id', 'person1', 'person2', 'roll_call', 'roll_call_name')
+    
+    def __init__(self, elem, lazy=False):
+        # Always decoded eagerly, since roll_call_name is derived from
+        # roll_call
+        super(Vote, self).__init__(elem)
+        try:
+            self.roll_call_name = str(self.roll_call)
+        except AttributeError:
+            pass
+    
+    def _decode(self, prop):
+        if prop.tag.startswith('person'):
+            return prop.getchildren()[0].text
+        elif prop.tag == 'roll-call':
+            return RollCall(prop)
+        return deserialize(prop)
     
     def __str__(self):
         return self.roll_call_name
 
 
+class FixedOffset(tzinfo):
+    """
+    A time zone at a fixed offset from UTC, in minutes east.
+    """
+    def __init__(self, minutes):
+        self._minutes = minutes
+        self._offset = timedelta(minutes=minutes)
+        sign = '-' if minutes < 0 else '+'
+        self._name = '%s%02d%02d' % ((sign,) + divmod(abs(minutes), 60))
+    
+    def utcoffset(self, dt):
+        return self._offset
+    
+    def dst(self, dt):
+        return timedelta(0)
+    
+    def tzname(self, dt):
+        return self._name
+    
+    def __getinitargs__(self):
+        return (self._minutes,)
+    
+    def __repr__(self):
+        return '<FixedOffset %s>' % self._name
+
+
+_MONTHS = dict((name, i + 1) for i, name in enumerate(
+    'Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec'.split()))
+_OFFSETS = {}
+_TIMESTAMPS = {}
+_DATES = {}
+
+# Bounds the memoized dates and timestamps
+_MEMO_SIZE = 10000
+
+def parse_timestamp(text):
+    """
+    Parses an OpenCongress timestamp ('%a %b %d %H:%M:%S +ZZZZ %Y') into a
+    time zone aware datetime.datetime. Results are memoized, since many
+    nodes share a timestamp.
+    
+    >>> parse_timestamp('Fri Jun 26 19:52:03 -0400 2009')
+    datetime.datetime(2009, 6, 26, 19, 52, 3, tzinfo=<FixedOffset -0400>)
+    """
+    try:
+        return _TIMESTAMPS[text]
+    except KeyError:
+        pass
+    weekday, month, day, clock, offset, year = text.split()
+    try:
+        tz = _OFFSETS[offset]
+    except KeyError:
+        minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+        tz = _OFFSETS[offset] = FixedOffset(-minutes if offset[0] == '-' \
+            else minutes)
+    value = datetime(int(year), _MONTHS[month], int(day), int(clock[0:2]), \
+        int(clock[3:5]), int(clock[6:8]), 0, tz)
+    if len(_TIMESTAMPS) >= _MEMO_SIZE:
+        _TIMESTAMPS.clear()
+    _TIMESTAMPS[text] = value
+    return value
+
+def parse_date(text):
+    """
+    Parses an OpenCongress date ('%Y-%m-%d') into a datetime.date. Results
+    are memoized.
+    
+    >>> parse_date('2009-06-26')
+    datetime.date(2009, 6, 26)
+    """
+    try:
+        return _DATES[text]
+    except KeyError:
+        pass
+    year, month, day = text.split('-')
+    value = date(int(year), int(month), int(day))
+    if len(_DATES) >= _MEMO_SIZE:
+        _DATES.clear()
+    _DATES[text] = value
+    return value
+
+def _date(elem):
+    return parse_date(elem.text)
+
+def _timestamp(elem):
+    return parse_timestamp(elem.text)
+
+class Postings(object):
+    """
+    A compact, read-only mapping of search terms to the positions at which
+    they occur, parsed from fti-titles/fti-names elements.
+    
+    Terms are kept sorted in a tuple of interned strings, and their
+    positions in one flat array: the positions of terms[i] are
+    positions[offsets[i]:offsets[i + 1]]. Reads behave like the dictionary
+    of lists these elements used to be parsed into.
+    
+    >>> postings['diann']
+    [2, 6, 8]
+    """
+    __slots__ = ('terms', 'offsets', 'positions')
+    
+    def __init__(self, members=None):
+        members = sorted((members or {}).items())
+        self.terms = tuple(intern(term) if isinstance(term, str) else term \
+            for term, values in members)
+        self.offsets = array('I', [0])
+        flat = []
+        for term, values in members:
+            flat.extend(values)
+            self.offsets.append(len(flat))
+        self.positions = array('H' if max(flat or [0]) < 2 ** 16 else 'I', \
+            flat)
+    
+    def _find(self, term):
+        i = bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        raise KeyError(term)
+    
+    def __getitem__(self, term):
+        i = self._find(term)
+        return self.positions[self.offsets[i]:self.offsets[i + 1]].tolist()
+    
+    def get(self, term, default=None):
+        try:
+            return self[term]
+        except KeyError:
+            return default
+    
+    def __contains__(self, term):
+        try:
+            self._find(term)
+        except KeyError:
+            return False
+        return True
+    
+    has_key = __contains__
+    
+    def __len__(self):
+        return len(self.terms)
+    
+    def __iter__(self):
+        return iter(self.terms)
+    
+    def keys(self):
+        return list(self.terms)
+    
+    def values(self):
+        return [self[term] for term in self.terms]
+    
+    def items(self):
+        return [(term, self[term]) for term in self.terms]
+    
+    iterkeys = __iter__
+    
+    def iteritems(self):
+        for term in self.terms:
+            yield term, self[term]
+    
+    def __eq__(self, other):
+        if isinstance(other, Postings):
+            return self.terms == other.terms and \
+                self.offsets == other.offsets and \
+                list(self.positions) == list(other.positions)
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+    
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+    
+    def __reduce__(self):
+        return (Postings, (dict(self.items()),))
+    
+    def __repr__(self):
+        return 'Postings({%s})' % ', '.join('%r: %r' % item \
+            for item in self.items())
+    
+    def arrays(self):
+        """
+        Returns the terms, offsets and positions as NumPy arrays, for
+        vectorized lookups. The offsets and positions share memory with this
+        object. Requires NumPy.
+        """
+        import numpy
+        return (
+            numpy.array(self.terms, dtype=object),
+            numpy.frombuffer(self.offsets, dtype='u%d' % \
+                self.offsets.itemsize),
+            numpy.frombuffer(self.positions, dtype='u%d' % \
+                self.positions.itemsize),
+        )
+
+
+def _postings(elem):
+    # These elements use a bizarre, undocumented format:
+    # 'd':4 'ca':5 'sen':1 'diann':2,6,8 'feinstein':3,7,9
+    # Let's parse that into something more sensible
+    members = {}
+    for m in (elem.text or '').split():
+        key, value = m.split(':')
+        members[key.replace("'", '')] = map(int, value.split(','))
+    return Postings(members)
+
+def _array(elem):
+    return [deserialize(prop) for prop in elem]
+
+def _boolean(elem):
+    return elem.text == 'true'
+
+def _struct(elem):
+    return dict((prop.tag.replace('-', '_'), deserialize(prop)) \
+        for prop in elem)
+
+# Converters chosen by an element's 'type' attribute
+TYPE_CONVERTERS = {
+    'date': _date,
+    'timestamp': _timestamp,
+    'integer': lambda elem: int(elem.text),
+    'float': lambda elem: float(elem.text),
+    'array': _array,
+    'boolean': _boolean,
+    'Commentary': lambda elem: Commentary(elem),
+    'Person': lambda elem: Person(elem),
+    'Vote': lambda elem: Vote(elem),
+}
+
+# Converters chosen by an element's tag, which take precedence over its type
+TAG_CONVERTERS = {
+    'sponsor': lambda elem: Person(elem),
+    'fti-titles': _postings,
+    'fti-names': _postings,
+}
+
+# Values of nil="true" elements, by type
+NIL_VALUES = {
+    'integer': 0,
+    'float': float(0),
+}
+
+def register_type(type_name, converter):
+    """
+    Registers converter(elem) as the deserializer of elements whose 'type'
+    attribute is type_name, replacing any existing one.
+    
+    >>> register_type('decimal', lambda elem: Decimal(elem.text))
+    """
+    TYPE_CONVERTERS[type_name] = converter
+
+def register_tag(tag, converter):
+    """
+    Registers converter(elem) as the deserializer of elements named tag,
+    regardless of their 'type' attribute, replacing any existing one.
+    
+    >>> register_tag('bill-titles', lambda elem: [t.text for t in elem])
+    """
+    TAG_CONVERTERS[tag] = converter
+
 def deserialize(elem):
     """
     Deserializes an OpenCongress XML Node (in form of an xml.etree.ElementTree
     element) into a Python datatype.
     
+    The element's tag is looked up in TAG_CONVERTERS first, then its 'type'
+    attribute in TYPE_CONVERTERS; elements with an unknown type deserialize
+    to None. Untyped elements become a dictionary of their children, or
+    their text if they have none.
+    
     In opencongress.classes instead of opencongress.utils to prevent circular
     imports (since BaseNode.__init__() calls deserialize, which requires 
     subclasses of BaseNode).
     """
+    attrib = elem.attrib
     
     # If the node has a 'nil' attribute, parse into None/0
-    try:
-        
-        if elem.attrib['nil'] == 'true':
-            try:
-                if elem.attrib['type'] == 'integer':
-                    return 0
-                elif elem.attrib['type'] == 'float':
-                    return float(0)
-            except KeyError:
-                return None
-        
-    except KeyError:
-        
-        # Overrides based on element name
-        
-        if elem.tag == 'sponsor':
-            elem.attrib['type'] = 'Person'
-        
-        # These elements use a bizarre, undocumented format:
-        # 'd':4 'ca':5 'sen':1 'diann':2,6,8 'feinstein':3,7,9
-        # Let's parse that into something more sensible
-        if elem.tag == 'fti-titles' or elem.tag == 'fti-names':
-            members = {}
-            for m in elem.text.split(' '):
-                key, value = m.split(':')
-                members[key.replace("'", '')] = map(int, value.split(','))
-            return members
-        
-        # If the element has a 'type' attribute, use that to decide
-        try:
-            
-            # Parse into datetime.date object
-            if elem.attrib['type'] == 'date':
-                year, month, day = map(int, elem.text.split('-'))
-                return date(year, month, day)
-            
-            # Parse into datetime.datetime object
-            if elem.attrib['type'] == 'timestamp':
-                # Time zone stripped because %z is not well-supported
-                # See http://bugs.python.org/issue6641
-                # Possible future todo: use dateutil.parser.parse instead
-                timezoneless = re.sub(r'[+\-]\d{4} ', '', elem.text)
-                return datetime.strptime(timezoneless, '%a %b %d %H:%M:%S %Y')
-            
-            # Parse into integer
-            elif elem.attrib['type'] == 'integer':
-                return int(elem.text)
-            
-            # Parse into float
-            elif elem.attrib['type'] == 'float':
-                return float(elem.text)
-            
-            # Parse into array populated with children elements
-            elif elem.attrib['type'] == 'array':
-                kids = []
-                for prop in elem.getchildren():
-                    kids.append(deserialize(prop))
-                return kids
-            
-            # Parse into an opencongress.classes.Commentary object
-            elif elem.attrib['type'] == 'Commentary':
-                return Commentary(elem)
-            
-            # Parse into an opencongress.classes.Person object
-            elif elem.attrib['type'] == 'Person':
-                return Person(elem)
-            
-            # Parse into an opencongress.classes.Vote object
-            elif elem.attrib['type'] == 'Vote':
-                return Vote(elem)
-            
-            # Parse into boolean
-            elif elem.attrib['type'] == 'boolean':
-                if elem.text == 'true':
-                    return True
-                return False
-        
-        # Since there's no type attribute, we'll try to guess.
-        except KeyError:
-            
-            # If it has children, parse into a dictionary
-            if len(elem.getchildren()):
-                kids = {}
-                for prop in elem.getchildren():
-                    kids[prop.tag.replace('-', '_')] = deserialize(prop)
-                return kids
-            
-            # Nothing left but to return a string.
-            return elem.text
\ No newline at end of file
+    if 'nil' in attrib:
+        if attrib['nil'] == 'true':
+            return NIL_VALUES.get(attrib.get('type'))
+        return None
+    
+    converter = TAG_CONVERTERS.get(elem.tag)
+    if converter is None:
+        type_name = attrib.get('type')
+        if type_name is None:
+            # Since there's no type attribute, we'll try to guess.
+            if len(elem):
+                return _struct(elem)
+            return elem.text
+        converter = TYPE_CONVERTERS.get(type_name)
+        if converter is None:
+            return None
+    return converter(elem)
@@ -0,0 +1,230 @@
+from collections import OrderedDict
+from datetime import date, datetime
+
+from opencongress import classes
+
+
+# NumPy dtypes of the scalar types deserialize() understands
+DTYPES = {
+    'integer': 'int64',
+    'float': 'float64',
+    'boolean': 'bool',
+    'date': 'datetime64[D]',
+    'timestamp': 'datetime64[s]',
+}
+
+
+class Categorical(object):
+    """
+    A string column stored as integer codes into an array of its distinct
+    values. Missing values have the code -1.
+    """
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.codes)
+
+    def values(self):
+        """
+        Returns the column as an object array of strings (None if missing).
+        """
+        import numpy
+        values = numpy.empty(len(self.codes), dtype=object)
+        present = self.codes >= 0
+        values[present] = self.categories[self.codes[present]]
+        return values
+
+
+class _Column(object):
+    __slots__ = ('type', 'rows', 'values')
+
+    def __init__(self, type_name):
+        self.type = type_name
+        self.rows = []
+        self.values = []
+
+
+class ColumnBuilder(object):
+    """
+    Collects the fields of results into one list of values per field, in a
+    single pass, then turns them into NumPy arrays. Results are added either
+    as XML elements (see add_element()), which skips building Bill/Person
+    objects altogether, or as objects already built (see add_node()).
+
+    Parameters
+    ==========
+    fields = A list of the field names to keep. All fields by default.
+
+    """
+
+    def __init__(self, fields=None):
+        self.fields = fields and set(fields)
+        self.rows = 0
+        self._columns = OrderedDict()
+
+    def add_element(self, elem):
+        """
+        Adds the result whose XML element is elem.
+        """
+        for prop in elem:
+            name = prop.tag.replace('-', '_')
+            if self.fields is None or name in self.fields:
+                self._add(name, _element_type(prop), classes.deserialize(prop))
+        self.rows += 1
+
+    def add_node(self, node):
+        """
+        Adds a result object, such as a Bill or Person.
+        """
+        for name, value in vars(node).items():
+            if self.fields is None or name in self.fields:
+                self._add(name, _value_type(value), value)
+        self.rows += 1
+
+    def _add(self, name, type_name, value):
+        column = self._columns.get(name)
+        if column is None:
+            column = self._columns[name] = _Column(type_name)
+        elif column.type != type_name:
+            # Mixed types fall back to an object column
+            column.type = 'object'
+        column.rows.append(self.rows)
+        column.values.append(value)
+
+    def columns(self, categorical=()):
+        """
+        Returns an OrderedDict mapping each field to a NumPy array with one
+        item per result. Requires NumPy.
+
+        Integer, float, boolean, date and timestamp fields become typed
+        arrays; an integer or boolean field missing from some results
+        becomes a float64 (NaN) or object (None) array instead, and missing
+        dates are NaT. Timestamps are converted to UTC. String fields become
+        object arrays, or Categoricals if named in categorical. Anything
+        else (nested people, lists, postings) is kept in an object array.
+        """
+        import numpy
+        categorical = set(categorical)
+        columns = OrderedDict()
+        for name, column in self._columns.items():
+            columns[name] = _array(numpy, self.rows, column, \
+                name in categorical)
+        return columns
+
+    def records(self, categorical=()):
+        """
+        Returns the columns as a NumPy record array. Categorical columns are
+        stored as their codes.
+        """
+        import numpy
+        columns = self.columns(categorical)
+        arrays = [column.codes if isinstance(column, Categorical) \
+            else column for column in columns.values()]
+        return numpy.rec.fromarrays(arrays, names=list(columns))
+
+
+def _element_type(prop):
+    if prop.tag in classes.TAG_CONVERTERS:
+        return 'object'
+    type_name = prop.get('type')
+    if type_name is None:
+        return 'object' if len(prop) else 'string'
+    return type_name if type_name in DTYPES else 'object'
+
+
+def _value_type(value):
+    # bool before int, and datetime before date, as each subclasses the other
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, (int, long)):
+        return 'integer'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, datetime):
+        return 'timestamp'
+    if isinstance(value, date):
+        return 'date'
+    if isinstance(value, basestring):
+        return 'string'
+    return 'object'
+
+
+def _array(numpy, length, column, categorical):
+    pairs = [(row, value) for row, value in zip(column.rows, column.values) \
+        if value is not None]
+    rows = [row for row, value in pairs]
+    values = [value for row, value in pairs]
+    complete = len(rows) == length
+
+    if column.type == 'string' and categorical:
+        categories = sorted(set(values))
+        index = dict((category, i) for i, category in enumerate(categories))
+        codes = numpy.empty(length, dtype='int32')
+        codes.fill(-1)
+        codes[rows] = [index[value] for value in values]
+        return Categorical(codes, numpy.array(categories, dtype=object))
+
+    if column.type in ('integer', 'boolean') and complete:
+        array = numpy.empty(length, dtype=DTYPES[column.type])
+    elif column.type in ('integer', 'float'):
+        array = numpy.empty(length, dtype='float64')
+        array.fill(numpy.nan)
+    elif column.type in ('date', 'timestamp'):
+        array = numpy.empty(length, dtype=DTYPES[column.type])
+        array.fill(numpy.datetime64('NaT'))
+        if column.type == 'date':
+            values = [value.isoformat() for value in values]
+        else:
+            values = [(value - value.utcoffset()).replace(tzinfo=None) \
+                if value.utcoffset() is not None else value \
+                for value in values]
+    else:
+        # Assigned one by one, so that list values stay single items
+        array = numpy.empty(length, dtype=object)
+        for row, value in zip(rows, values):
+            array[row] = value
+        return array
+    if rows:
+        array[rows] = numpy.array(values, dtype=array.dtype)
+    return array
+
+
+def from_call(call, fields=None):
+    """
+    Sends call and returns a ColumnBuilder filled straight from the XML of
+    its results, one element at a time.
+    """
+    builder = ColumnBuilder(fields)
+    for elem in call.iterelements():
+        builder.add_element(elem)
+    return builder
+
+
+def from_results(results, fields=None):
+    """
+    Returns a ColumnBuilder filled from results, a list of Bill, Person or
+    other result objects.
+    """
+    builder = ColumnBuilder(fields)
+    for node in results:
+        builder.add_node(node)
+    return builder
+
+
+def to_columns(results, fields=None, categorical=()):
+    """
+    Returns an OrderedDict mapping each field of results (a list of Bill,
+    Person or other result objects) to a NumPy array. See
+    ColumnBuilder.columns().
+    """
+    return from_results(results, fields).columns(categorical)
+
+
+def to_records(results, fields=None, categorical=()):
+    """
+    Returns results (a list of Bill, Person or other result objects) as a
+    NumPy record array. See ColumnBuilder.records().
+    """
+    return from_results(results, fields).records(categorical)
@@ -0,0 +1,171 @@
+from datetime import date, datetime
+import cPickle as pickle
+import sqlite3, threading
+
+from opencongress.calls import bill_ident
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS bills (
+    id INTEGER PRIMARY KEY,
+    ident TEXT,
+    session INTEGER,
+    bill_type TEXT,
+    number INTEGER,
+    introduced INTEGER,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bills_ident ON bills (ident);
+CREATE INDEX IF NOT EXISTS bills_introduced ON bills (introduced);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+class BillMirror(object):
+    """
+    A local SQLite copy of OpenCongress.org's bills. Fill it once with
+    load(), then keep it current with sync(), which asks only for the bills
+    introduced since the newest one already stored (the high-water mark).
+    Bills are upserted by id, so fetching a bill again replaces the stored
+    copy.
+
+    >>> mirror = BillMirror(api, '/var/lib/oc/bills.db')
+    >>> mirror.load(congress=111)
+    >>> mirror.sync()
+    >>> mirror.get('111-h2454')
+    <OpenCongress Bill object (H.R.2454 ...)>
+
+    Parameters
+    ==========
+    api = The opencongress.Api instance to fetch bills with
+    path = A string specifying the database file. ':memory:' keeps the
+        mirror in memory.
+
+    """
+
+    # bills_introduced_since returns at most this many bills per request
+    _page_size = 30
+
+    def __init__(self, api, path):
+        self.api = api
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.executescript(_SCHEMA)
+
+    def load(self, **kwargs):
+        """
+        Stores every bill returned by api.iter_bills(**kwargs), streaming
+        them into the database as they are read. Returns the number of bills
+        stored.
+        """
+        return self.upsert(self.api.iter_bills(**kwargs))
+
+    def sync(self):
+        """
+        Fetches and stores the bills introduced since the high-water mark
+        (or, for an empty mirror, today). Returns the number of bills stored.
+
+        A full page may have been cut short, and as the mark only has day
+        granularity the bills it left out can't be asked for by date. In that
+        case the page is not stored; the Congresses its bills belong to are
+        reloaded with load() instead, which advances the mark once they are
+        complete.
+        """
+        since = self.high_water or date.today()
+        bills = self.api.bills_introduced_since(since)
+        if len(bills) < self._page_size:
+            return self.upsert(bills)
+        sessions = set(getattr(bill, 'session', None) for bill in bills)
+        if None in sessions:
+            raise ValueError('A full page of bills came back without the ' \
+                'Congress to reload')
+        return sum(self.load(congress=session) for session in \
+            sorted(sessions))
+
+    def upsert(self, bills):
+        """
+        Stores bills, replacing any stored under the same id, and advances
+        the high-water mark past the newest of them. Returns the number of
+        bills stored.
+        """
+        rows = (self._row(bill) for bill in bills)
+        with self._lock:
+            with self._db:
+                cursor = self._db.executemany('INSERT OR REPLACE INTO bills ' \
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                newest = self._db.execute('SELECT MAX(introduced) ' \
+                    'FROM bills').fetchone()[0]
+                if newest is not None:
+                    self._db.execute('INSERT OR REPLACE INTO meta ' \
+                        'VALUES (?, ?)', ('high_water', newest))
+        return max(cursor.rowcount, 0)
+
+    @property
+    def high_water(self):
+        """
+        The date the newest stored bill was introduced on, or None.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT value FROM meta ' \
+                'WHERE name = ?', ('high_water',)).fetchone()
+        if row is None:
+            return None
+        return datetime.utcfromtimestamp(int(row[0])).date()
+
+    def get(self, ident):
+        """
+        Returns the stored bill with the passed ident (e.g. '111-h2454'), or
+        None.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT data FROM bills WHERE ident = ?', \
+                (ident.lower(),)).fetchone()
+        return row and pickle.loads(str(row[0]))
+
+    def bills(self, session=None, bill_type=None):
+        """
+        Returns the stored bills, optionally only those of one Congress
+        and/or of one type, in the order they were introduced.
+        """
+        query = 'SELECT data FROM bills'
+        clauses, params = [], []
+        if session is not None:
+            clauses.append('session = ?')
+            params.append(session)
+        if bill_type is not None:
+            clauses.append('bill_type = ?')
+            params.append(bill_type)
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        with self._lock:
+            rows = self._db.execute(query + ' ORDER BY introduced, id', \
+                params).fetchall()
+        return [pickle.loads(str(row[0])) for row in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM bills').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+    def _row(self, bill):
+        get = lambda name: getattr(bill, name, None)
+        try:
+            ident = str(bill_ident(bill)).lower()
+        except AttributeError:
+            ident = None
+        return (
+            bill.id,
+            ident,
+            get('session'),
+            get('bill_type'),
+            get('number'),
+            get('introduced'),
+            sqlite3.Binary(pickle.dumps(bill, pickle.HIGHEST_PROTOCOL)),
+        )
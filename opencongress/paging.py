@@ -0,0 +1,62 @@
+from collections import deque
+from multiprocessing.pool import ThreadPool
+import time
+
+
+class PageIterator(object):
+    """
+    Yields the results of a paginated call page after page, while the next
+    prefetch pages are fetched on background threads. Iteration stops at the
+    first page that comes back empty.
+
+    Parameters
+    ==========
+    fetch = A function that takes a page number and returns that page's list
+        of results
+    page = An integer specifying the first page to fetch
+    prefetch = An integer specifying how many pages to fetch ahead of the one
+        being consumed. 0 fetches one page at a time.
+
+    """
+
+    def __init__(self, fetch, page=1, prefetch=2):
+        self._fetch = fetch
+        self._page = page
+        self.prefetch = max(0, prefetch)
+        self._pages = 0
+        self._waited = 0.0
+        self._results = self._iter()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self._results)
+
+    def stats(self):
+        """
+        Returns a dictionary holding the number of pages fetched so far and
+        the time, in seconds, spent waiting for them.
+        """
+        return {'pages': self._pages, 'waited': self._waited}
+
+    def _iter(self):
+        pool = ThreadPool(self.prefetch + 1)
+        pending = deque()
+        try:
+            while True:
+                while len(pending) <= self.prefetch:
+                    pending.append(pool.apply_async(self._fetch, \
+                        (self._page,)))
+                    self._page += 1
+                started = time.time()
+                results = pending.popleft().get()
+                self._waited += time.time() - started
+                self._pages += 1
+                if not results:
+                    return
+                for result in results:
+                    yield result
+        finally:
+            # Pages fetched past the last one are discarded
+            pool.terminate()
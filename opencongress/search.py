@@ -0,0 +1,339 @@
+from bisect import bisect_left, bisect_right
+import cPickle as pickle
+import math, re, threading
+
+from opencongress import calls, exceptions, utils
+
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+_QUERY = re.compile(r'"([^"]*)"|(\S+)')
+
+# Title fields, in the order their words are numbered
+_TITLE_FIELDS = ('title_full_common', 'title_common', 'title_official', \
+    'manual_title')
+
+# Positions of fti-titles terms are offset by this much, so that a phrase
+# can't straddle a title word and a stemmed term
+_FTI_OFFSET = 1 << 20
+
+# BM25 parameters
+_K1 = 1.2
+_B = 0.75
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+class BillIndex(object):
+    """
+    A local inverted index of bills, searchable by the words of their titles
+    and by the stemmed terms of their fti-titles postings, so that searches
+    over bills already in hand need no round trip.
+
+    >>> index = BillIndex()
+    >>> index.add(api.bills(congress=111))
+    >>> index.search('"clean energy" secur*')
+    [<OpenCongress Bill object (H.R.2454 ...)>]
+
+    A query is a series of clauses, all of which must match: a word, a
+    quoted phrase, or a word ending in * to match any term with that prefix.
+    Results are ranked by BM25.
+    """
+
+    version = 1
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bills = []
+        self._lengths = []
+        self._terms_of = []
+        self._ids = {}
+        self._postings = {}
+        self._sorted_terms = None
+        self._live = 0
+        self._total_length = 0
+
+    def __len__(self):
+        return self._live
+
+    def add(self, bills):
+        """
+        Adds bills to the index. A bill already indexed (by id) is replaced.
+        """
+        with self._lock:
+            for bill in bills:
+                self._add(bill)
+            self._sorted_terms = None
+
+    def _add(self, bill):
+        key = getattr(bill, 'id', None)
+        terms = self._terms(bill)
+        length = sum(len(positions) for positions in terms.values())
+        if key is not None and key in self._ids:
+            # Replaced in place, so that document frequencies and the number
+            # of documents only ever count live bills
+            doc = self._ids[key]
+            for term in self._terms_of[doc]:
+                postings = self._postings[term]
+                del postings[doc]
+                if not postings:
+                    del self._postings[term]
+            self._total_length -= self._lengths[doc]
+            self._bills[doc] = bill
+            self._lengths[doc] = length
+            self._terms_of[doc] = tuple(terms)
+        else:
+            doc = len(self._bills)
+            self._bills.append(bill)
+            self._lengths.append(length)
+            self._terms_of.append(tuple(terms))
+            self._live += 1
+            if key is not None:
+                self._ids[key] = doc
+        for term, positions in terms.items():
+            self._postings.setdefault(term, {})[doc] = tuple(positions)
+        self._total_length += length
+
+    def _terms(self, bill):
+        # Returns the positions of each term of bill
+        terms = {}
+        position = 0
+        for field in _TITLE_FIELDS:
+            text = getattr(bill, field, None)
+            if not text:
+                continue
+            for token in tokenize(text):
+                terms.setdefault(token, []).append(position)
+                position += 1
+            # Keep phrases from running across fields
+            position += 1
+        fti = getattr(bill, 'fti_titles', None) or {}
+        for term, positions in fti.items():
+            terms.setdefault(term, []).extend(p + _FTI_OFFSET \
+                for p in positions)
+        return terms
+
+    def search(self, query, limit=None):
+        """
+        Returns the indexed bills matching query, best match first.
+        """
+        return [bill for bill, score in self.scored(query, limit)]
+
+    def scored(self, query, limit=None):
+        """
+        Returns (bill, score) pairs for the indexed bills matching query,
+        best match first.
+        """
+        clauses = []
+        for phrase, word in _QUERY.findall(query):
+            if phrase:
+                tokens = tokenize(phrase)
+                if tokens:
+                    clauses.append(('phrase', tokens))
+            elif word.endswith('*') and tokenize(word):
+                clauses.append(('prefix', tokenize(word)[0]))
+            else:
+                clauses.extend(('term', token) for token in tokenize(word))
+        if not clauses:
+            raise exceptions.ArgumentError('Empty search query')
+
+        with self._lock:
+            scores = None
+            for kind, value in clauses:
+                matches = getattr(self, '_match_%s' % kind)(value)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = dict((doc, score + matches[doc]) for doc, score \
+                        in scores.iteritems() if doc in matches)
+                if not scores:
+                    return []
+            ranked = sorted(scores.iteritems(), \
+                key=lambda item: (-item[1], item[0]))
+            results = [(self._bills[doc], score) for doc, score in ranked \
+                if self._bills[doc] is not None]
+        return results[:limit] if limit is not None else results
+
+    def _score(self, postings, scores, docs=None):
+        # Adds the BM25 score of one term to scores, for each doc in docs
+        # (defaults to every doc the term occurs in)
+        live = float(max(self._live, 1))
+        average = self._total_length / live or 1.0
+        idf = math.log(1 + (live - len(postings) + 0.5) / \
+            (len(postings) + 0.5))
+        for doc in (postings if docs is None else docs):
+            tf = len(postings[doc])
+            norm = _K1 * (1 - _B + _B * self._lengths[doc] / average)
+            scores[doc] = scores.get(doc, 0) + idf * tf * (_K1 + 1) / \
+                (tf + norm)
+        return scores
+
+    def _match_term(self, term):
+        return self._score(self._postings.get(term, {}), {})
+
+    def _match_prefix(self, prefix):
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._postings)
+        terms = self._sorted_terms
+        scores = {}
+        i = bisect_left(terms, prefix)
+        while i < len(terms) and terms[i].startswith(prefix):
+            self._score(self._postings[terms[i]], scores)
+            i += 1
+        return scores
+
+    def _match_phrase(self, tokens):
+        postings = [self._postings.get(token, {}) for token in tokens]
+        docs = set(postings[0])
+        for other in postings[1:]:
+            docs.intersection_update(other)
+        matched = []
+        for doc in docs:
+            starts = set(postings[0][doc])
+            for offset, other in enumerate(postings[1:]):
+                starts.intersection_update(p - offset - 1 \
+                    for p in other[doc])
+            if starts:
+                matched.append(doc)
+        scores = {}
+        for term_postings in postings:
+            self._score(term_postings, scores, matched)
+        return scores
+
+    def save(self, path):
+        """
+        Writes the index to path, atomically replacing any existing file.
+        """
+        def write(f):
+            with self._lock:
+                pickle.dump((self.version, self._bills, self._lengths, \
+                    self._ids, self._postings, self._live, \
+                    self._total_length), f, pickle.HIGHEST_PROTOCOL)
+        utils.write_atomically(path, write)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads an index written by save().
+        """
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state[0] != cls.version:
+            raise exceptions.ArgumentError('Unsupported index version: %s' \
+                % state[0])
+        index = cls()
+        (index._bills, index._lengths, index._ids, index._postings, \
+            index._live, index._total_length) = state[1:]
+        index._terms_of = [[] for bill in index._bills]
+        for term, postings in index._postings.iteritems():
+            for doc in postings:
+                index._terms_of[doc].append(term)
+        return index
+
+
+class PeopleIndex(object):
+    """
+    A local copy of the people OpenCongress.org knows about, indexed on each
+    filter of the people endpoint, so that lookups need no round trip. Equal
+    filters are answered from hash indexes and user approval ranges from a
+    sorted index; a query costs time in proportion to the people its most
+    selective filter matches.
+
+    >>> index = PeopleIndex(api.people())
+    >>> index.query(state='MN', party='Democrat', user_approval=(5, 10))
+    [<OpenCongress Person object (Sen. Al Franken [D, MN])>...]
+
+    query() accepts the keyword arguments of Api.people() and validates them
+    the same way.
+    """
+
+    # People endpoint filters, and the Person fields they match
+    _fields = {
+        'first_name': 'firstname',
+        'last_name': 'lastname',
+        'person_id': 'person_id',
+        'gender': 'gender',
+        'state': 'state',
+        'district': 'district',
+        'party': 'party',
+    }
+
+    def __init__(self, people):
+        self._people = list(people)
+        self._indexes = dict((kwarg, {}) for kwarg in self._fields)
+        approvals = []
+        for position, person in enumerate(self._people):
+            for kwarg, field in self._fields.items():
+                value = getattr(person, field, None)
+                if value is not None:
+                    self._indexes[kwarg].setdefault(_key(value), \
+                        []).append(position)
+            try:
+                approvals.append((float(person.user_approval), position))
+            except (AttributeError, TypeError, ValueError):
+                pass
+        approvals.sort()
+        self._approvals = [approval for approval, position in approvals]
+        self._approval_positions = [position for approval, position \
+            in approvals]
+
+    def __len__(self):
+        return len(self._people)
+
+    def query(self, **kwargs):
+        """
+        Returns the people matching every filter, in the order they were
+        loaded.
+        """
+        # Validates and normalizes the filters exactly as a request would
+        urlargs = calls.People(None, fetch=False, **kwargs).urlargs
+        urlargs.pop('key', None)
+
+        # Each filter is (matching positions, test for a single person)
+        filters = []
+        for kwarg, value in urlargs.items():
+            if kwarg in self._indexes:
+                key = _key(value)
+                filters.append((self._indexes[kwarg].get(key, []), \
+                    _equals(self._fields[kwarg], key)))
+        if 'user_approval_from' in urlargs or 'user_approval_to' in urlargs:
+            low = float(urlargs.get('user_approval_from', '-inf'))
+            high = float(urlargs.get('user_approval_to', 'inf'))
+            filters.append((self._approval_positions[
+                bisect_left(self._approvals, low):
+                bisect_right(self._approvals, high)
+            ], _between(low, high)))
+        if not filters:
+            return list(self._people)
+
+        # Start from the most selective filter and test the rest on each
+        # of its matches
+        filters.sort(key=lambda f: len(f[0]))
+        positions, tests = filters[0][0], [test for _, test in filters[1:]]
+        return [self._people[position] for position in sorted(positions) \
+            if all(test(self._people[position]) for test in tests)]
+
+
+def _equals(field, key):
+    def test(person):
+        value = getattr(person, field, None)
+        return value is not None and _key(value) == key
+    return test
+
+
+def _between(low, high):
+    def test(person):
+        try:
+            return low <= float(person.user_approval) <= high
+        except (AttributeError, TypeError, ValueError):
+            return False
+    return test
+
+
+def _key(value):
+    # Index keys compare case-insensitively, and regardless of whether the
+    # value was given as a string or a number
+    if isinstance(value, basestring):
+        return value.lower()
+    return unicode(value)
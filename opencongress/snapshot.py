@@ -0,0 +1,419 @@
+"""
+A compact binary format for lists of result objects (Bill, Person, Issue,
+Vote and the nodes nested in them), which loads far faster than the XML
+they were parsed from.
+
+A snapshot is a string table followed by a table of nodes. Tables are
+stored by column: for each field, a state per row (absent, None or set)
+and the set values packed into a typed array. Strings are stored once, as
+UTF-8, and referred to by index; timestamps are stored to the
+microsecond; nested nodes and lists of nodes are stored as a nested table,
+with offsets into it for lists; postings keep their flat arrays. Values of
+any other type are pickled.
+
+>>> save_snapshot(api.bills(congress=111), '/tmp/bills.snapshot')
+>>> bills = load_snapshot('/tmp/bills.snapshot')
+"""
+from array import array
+from datetime import date, datetime, timedelta
+import cPickle as pickle
+import gc, struct
+
+from opencongress import classes, exceptions, utils
+
+
+MAGIC = 'OCSNAP'
+VERSION = 2
+
+# Row states
+_ABSENT, _SET, _NONE = 0, 1, 2
+
+# Timestamps without a time zone are stored with this offset
+_NAIVE = -32768
+
+_EPOCH = datetime(1970, 1, 1)
+
+_HEADER = struct.Struct('<6sH')
+_COUNT = struct.Struct('<I')
+
+
+def save_snapshot(nodes, path):
+    """
+    Writes a list of result objects to path, atomically replacing any
+    existing file.
+    """
+    data = _HEADER.pack(MAGIC, VERSION) + encode(nodes)
+    utils.write_atomically(path, lambda f: f.write(data))
+
+
+def load_snapshot(path, suspend_gc=False):
+    """
+    Reads a list of result objects written by save_snapshot().
+
+    Loading allocates many objects but no reference cycles. With suspend_gc,
+    the garbage collector is disabled while they are built, so that a large
+    load doesn't spend its time in collections traversing the heap. This
+    affects the whole process, and so is left to the caller to ask for.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        magic, version = _HEADER.unpack_from(data)
+    except struct.error:
+        magic = version = None
+    if magic != MAGIC:
+        raise exceptions.ArgumentError('Not a snapshot: %s' % path)
+    if version != VERSION:
+        raise exceptions.ArgumentError('Unsupported snapshot version: %s' \
+            % version)
+    if not suspend_gc or not gc.isenabled():
+        return decode(data, _HEADER.size)
+    gc.disable()
+    try:
+        return decode(data, _HEADER.size)
+    finally:
+        gc.enable()
+
+
+def encode(nodes):
+    """
+    Returns a list of result objects encoded as a string table and a node
+    table, without the file header.
+    """
+    writer = _Writer()
+    table = writer.table(list(nodes))
+    offsets = [0]
+    for string in writer.strings:
+        offsets.append(offsets[-1] + len(string))
+    return _pack('I', offsets) + ''.join(writer.strings) + ''.join(table)
+
+
+def decode(data, position=0):
+    """
+    Reads the result objects encoded at position in data, which may be any
+    buffer struct can unpack from (e.g. an mmap). Data is read through
+    buffers, so only the strings and pickles of values are copied out.
+    """
+    reader = _Reader(data, position)
+    offsets = reader.unpack('I')
+    blob = reader.bytes(offsets[-1] if offsets else 0)
+    reader.strings = [blob[offsets[i]:offsets[i + 1]] \
+        for i in range(len(offsets) - 1)]
+    return reader.table()
+
+
+def _pack(code, values):
+    # A count, then the values as little-endian code
+    return _COUNT.pack(len(values)) + struct.pack('<%d%s' % (len(values), \
+        code), *values)
+
+
+class _Writer(object):
+
+    def __init__(self):
+        self.strings = []
+        self._string_ids = {}
+
+    def string(self, value):
+        try:
+            return self._string_ids[value]
+        except KeyError:
+            index = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+            return index
+
+    def table(self, nodes):
+        # Returns the encoded table as a list of strings
+        chunks = []
+        names = []
+        class_ids = []
+        for node in nodes:
+            name = node.__class__.__name__
+            if name not in names:
+                names.append(name)
+            class_ids.append(names.index(name))
+        self._strings(chunks, names)
+        chunks.append(_pack('B', class_ids))
+
+        rows = [vars(node) for node in nodes]
+        fields = []
+        for row in rows:
+            for name in row:
+                if name not in fields:
+                    fields.append(name)
+        chunks.append(_COUNT.pack(len(fields)))
+        for name in fields:
+            states = []
+            values = []
+            for row in rows:
+                if name not in row:
+                    states.append(_ABSENT)
+                elif row[name] is None:
+                    states.append(_NONE)
+                else:
+                    states.append(_SET)
+                    values.append(row[name])
+            kind = _kind(values)
+            chunks.append(_COUNT.pack(self.string(name)))
+            chunks.append(kind)
+            chunks.append(_pack('b', states))
+            getattr(self, '_column_%s' % kind)(chunks, values)
+        return chunks
+
+    def _strings(self, chunks, values):
+        chunks.append(_pack('I', [self.string(value.encode('utf-8') \
+            if isinstance(value, unicode) else value) for value in values]))
+
+    def _column_i(self, chunks, values):
+        chunks.append(_pack('q', values))
+
+    def _column_f(self, chunks, values):
+        chunks.append(_pack('d', values))
+
+    def _column_b(self, chunks, values):
+        chunks.append(_pack('?', values))
+
+    def _column_s(self, chunks, values):
+        # str and unicode values may share a column; flag the unicode ones
+        self._strings(chunks, values)
+        chunks.append(_pack('?', [isinstance(value, unicode) \
+            for value in values]))
+
+    def _column_d(self, chunks, values):
+        chunks.append(_pack('i', [value.toordinal() for value in values]))
+
+    def _column_t(self, chunks, values):
+        microseconds = []
+        offsets = []
+        for value in values:
+            offset = value.utcoffset()
+            naive = value.replace(tzinfo=None)
+            delta = naive - _EPOCH
+            microseconds.append((delta.days * 86400 + delta.seconds) * \
+                10 ** 6 + delta.microseconds)
+            offsets.append(_NAIVE if offset is None else \
+                (offset.days * 86400 + offset.seconds) // 60)
+        chunks.append(_pack('q', microseconds))
+        chunks.append(_pack('h', offsets))
+
+    def _column_n(self, chunks, values):
+        chunks.extend(self.table(values))
+
+    def _column_l(self, chunks, values):
+        offsets = [0]
+        nodes = []
+        for value in values:
+            nodes.extend(value)
+            offsets.append(len(nodes))
+        chunks.append(_pack('I', offsets))
+        chunks.extend(self.table(nodes))
+
+    def _column_p(self, chunks, values):
+        # Each value's terms, offsets and positions, concatenated
+        counts = [0]
+        terms = []
+        offsets = []
+        positions = []
+        for value in values:
+            terms.extend(value.terms)
+            counts.append(len(terms))
+            offsets.extend(offset + len(positions) \
+                for offset in value.offsets[:-1])
+            positions.extend(value.positions)
+        offsets.append(len(positions))
+        chunks.append(_pack('I', counts))
+        self._strings(chunks, terms)
+        chunks.append(_pack('I', offsets))
+        chunks.append(_pack('I', positions))
+
+    def _column_o(self, chunks, values):
+        blobs = [pickle.dumps(value, pickle.HIGHEST_PROTOCOL) \
+            for value in values]
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        chunks.append(_pack('I', offsets))
+        chunks.append(''.join(blobs))
+
+
+def _kind(values):
+    # The column kind that can hold every value
+    types = set(long if type(value) is int else type(value) \
+        for value in values)
+    if types and types <= set([str, unicode]):
+        return 's'
+    if len(types) != 1:
+        if types and all(issubclass(t, classes.BaseNode) for t in types):
+            return 'n'
+        return 'o'
+    t = types.pop()
+    if t is bool:
+        return 'b'
+    if t is long and all(-2 ** 63 <= value < 2 ** 63 \
+            for value in values):
+        return 'i'
+    if t is float:
+        return 'f'
+    if t is datetime:
+        return 't'
+    if t is date:
+        return 'd'
+    if issubclass(t, classes.BaseNode):
+        return 'n'
+    if t is classes.Postings:
+        return 'p'
+    if t is list and all(isinstance(item, classes.BaseNode) \
+            for value in values for item in value):
+        return 'l'
+    return 'o'
+
+
+def _slot(node_classes, name):
+    # Returns the slot descriptor of name, if every node shares a class that
+    # declares it
+    if len(node_classes) != 1:
+        return None
+    slot = getattr(node_classes[0], name, None)
+    if type(slot) is _MemberDescriptor:
+        return slot
+    return None
+
+
+_MemberDescriptor = type(classes.Vote.id)
+
+
+class _Reader(object):
+
+    def __init__(self, data, position):
+        self.data = data
+        self.position = position
+        self.strings = None
+        self._offsets = {}
+
+    def count(self):
+        value, = _COUNT.unpack_from(self.data, self.position)
+        self.position += _COUNT.size
+        return value
+
+    def bytes(self, length):
+        # A buffer over the next length bytes, rather than a copy of them
+        value = buffer(self.data, self.position, length)
+        self.position += length
+        return value
+
+    def unpack(self, code):
+        length = self.count()
+        unpacker = struct.Struct('<%d%s' % (length, code))
+        values = unpacker.unpack_from(self.data, self.position)
+        self.position += unpacker.size
+        return values
+
+    def string_list(self):
+        strings = self.strings
+        return [strings[i] for i in self.unpack('I')]
+
+    def table(self):
+        names = self.string_list()
+        class_ids = self.unpack('B')
+        node_classes = []
+        for name in names:
+            cls = getattr(classes, name, None)
+            if not (isinstance(cls, type) and \
+                    issubclass(cls, classes.BaseNode)):
+                raise exceptions.ArgumentError('Unknown node class: %s' % \
+                    name)
+            node_classes.append(cls)
+        nodes = []
+        for class_id in class_ids:
+            node = node_classes[class_id].__new__(node_classes[class_id])
+            object.__setattr__(node, '_extra', None)
+            object.__setattr__(node, '_pending', None)
+            nodes.append(node)
+
+        for i in range(self.count()):
+            name = self.strings[self.count()]
+            kind = str(self.bytes(1))
+            states = self.unpack('b')
+            values = getattr(self, '_column_%s' % kind)()
+            slot = _slot(node_classes, name)
+            if slot is not None and len(values) == len(nodes):
+                # Every node has the field, and it is a slot of their class:
+                # set it with a single C-level loop
+                map(slot.__set__, nodes, values)
+                continue
+            values = iter(values)
+            for node, state in zip(nodes, states):
+                if state == _SET:
+                    node._store(name, next(values))
+                elif state == _NONE:
+                    node._store(name, None)
+        return nodes
+
+    def _column_i(self):
+        return self.unpack('q')
+
+    def _column_f(self):
+        return self.unpack('d')
+
+    def _column_b(self):
+        return self.unpack('?')
+
+    def _column_s(self):
+        values = self.string_list()
+        return [value.decode('utf-8') if is_unicode else value \
+            for value, is_unicode in zip(values, self.unpack('?'))]
+
+    def _column_d(self):
+        return [date.fromordinal(value) for value in self.unpack('i')]
+
+    def _column_t(self):
+        microseconds = self.unpack('q')
+        offsets = self.unpack('h')
+        values = []
+        for value, offset in zip(microseconds, offsets):
+            value = _EPOCH + timedelta(microseconds=value)
+            if offset != _NAIVE:
+                value = value.replace(tzinfo=self._offset(offset))
+            values.append(value)
+        return values
+
+    def _offset(self, minutes):
+        try:
+            return self._offsets[minutes]
+        except KeyError:
+            tz = self._offsets[minutes] = classes.FixedOffset(minutes)
+            return tz
+
+    def _column_n(self):
+        return self.table()
+
+    def _column_l(self):
+        offsets = self.unpack('I')
+        nodes = self.table()
+        return [nodes[offsets[i]:offsets[i + 1]] \
+            for i in range(len(offsets) - 1)]
+
+    def _column_p(self):
+        counts = self.unpack('I')
+        terms = [intern(term) for term in self.string_list()]
+        offsets = self.unpack('I')
+        positions = self.unpack('I')
+        values = []
+        for i in range(len(counts) - 1):
+            first, last = counts[i], counts[i + 1]
+            postings = classes.Postings.__new__(classes.Postings)
+            postings.terms = tuple(terms[first:last])
+            start = offsets[first]
+            postings.offsets = array('I', [offset - start \
+                for offset in offsets[first:last + 1]])
+            flat = positions[start:offsets[last]]
+            postings.positions = array('H' if max(flat or [0]) < 2 ** 16 \
+                else 'I', flat)
+            values.append(postings)
+        return values
+
+    def _column_o(self):
+        offsets = self.unpack('I')
+        blob = self.bytes(offsets[-1] if offsets else 0)
+        return [pickle.loads(blob[offsets[i]:offsets[i + 1]]) \
+            for i in range(len(offsets) - 1)]
@@ -1,4 +1,11 @@
 import opencongress, unittest
+import BaseHTTPServer, SocketServer, gzip, os, shutil, socket, StringIO, \
+    tempfile, threading, time, urlparse
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 API_KEY = '2670a003f1dab7cf502b8d39eb2a95639fc6849c'
 
@@ -31,6 +38,24 @@ class Utils(unittest.TestCase):
             url_date(datetime.date(2000, 1, 31)),
             'Jan 31st, 2000'
         )
+    
+    def test_write_atomically(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'state')
+        opencongress.utils.write_atomically(path, lambda f: f.write('old'))
+        def fail(f):
+            f.write('new')
+            raise IOError('disk full')
+        self.assertRaises(IOError, opencongress.utils.write_atomically, \
+            path, fail)
+        self.assertEqual(os.listdir(directory), ['state'])
+        with open(path) as f:
+            self.assertEqual(f.read(), 'old')
+        written = opencongress.utils.write_atomically(path, \
+            lambda f: f.write('new'), reopen=True)
+        self.assertEqual(written.read(), 'new')
+        written.close()
 
 
 class ApiMethods(unittest.TestCase):
@@ -496,5 +521,1434 @@ class ApiMethods(unittest.TestCase):
         )
 
 
+def gzip_string(data):
+    compressed = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj=compressed, mode='wb')
+    f.write(data)
+    f.close()
+    return compressed.getvalue()
+
+
+class FixtureHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        body = self.server.fixtures.get(path, '')
+        if callable(body):
+            # Fixtures that depend on the query string
+            body = body(urlparse.parse_qs(query))
+        status = 200 if body else 404
+        if isinstance(body, tuple):
+            status, body = body
+        etag = '"%s"' % hash(body)
+        if self.server.gzip and 'gzip' in self.headers.get( \
+                'Accept-Encoding', ''):
+            body = gzip_string(body)
+        self.server.requests.append(self.path)
+        time.sleep(self.server.delay)
+        if body and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+
+class FixtureServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A local keep-alive HTTP server that serves canned responses, keyed by
+    path, so the transport can be exercised without opencongress.org.
+    """
+    daemon_threads = True
+    
+    def __init__(self, fixtures):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), \
+            FixtureHandler)
+        self.fixtures = fixtures
+        self.requests = []
+        self.gzip = False
+        self.delay = 0
+        self.url = 'http://127.0.0.1:%s' % self.server_address[1]
+        thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+    
+    def handle_error(self, request, client_address):
+        # Clients hanging up on a keep-alive connection are expected
+        pass
+
+
+class FixtureTransport(opencongress.transport.ConnectionPool):
+    """
+    A connection pool that sends requests meant for opencongress.org to a
+    FixtureServer instead.
+    """
+    def __init__(self, server, *args, **kwargs):
+        opencongress.transport.ConnectionPool.__init__(self, *args, **kwargs)
+        self.server = server
+    
+    def urlopen(self, url, *args, **kwargs):
+        url = url.replace('http://www.opencongress.org', self.server.url)
+        return opencongress.transport.ConnectionPool.urlopen(self, url, \
+            *args, **kwargs)
+
+
+BILLS_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<bills type="array">
+  <bill>
+    <id type="integer">57656</id>
+    <bill-type>h</bill-type>
+    <number type="integer">2454</number>
+    <session type="integer">111</session>
+    <title-full-common>H.R.2454 American Clean Energy and Security Act of 2009</title-full-common>
+    <introduced type="integer">1242964800</introduced>
+    <last-action-at type="date">2009-06-26</last-action-at>
+    <updated type="timestamp">Fri Jun 26 19:52:03 -0400 2009</updated>
+    <hot-bill-category-id nil="true" type="integer"></hot-bill-category-id>
+    <page-views-count type="float">12.5</page-views-count>
+    <is-major type="boolean">true</is-major>
+    <fti-titles>'clean':2,7 'energi':3 'secur':5</fti-titles>
+    <sponsor>
+      <name>Rep. Henry Waxman [D, CA-30]</name>
+      <person-id type="integer">400425</person-id>
+    </sponsor>
+    <co-sponsors type="array">
+      <co-sponsor>
+        <name>Rep. Edward Markey [D, MA-7]</name>
+        <person-id type="integer">400253</person-id>
+      </co-sponsor>
+    </co-sponsors>
+  </bill>
+  <bill>
+    <id type="integer">60845</id>
+    <bill-type>h</bill-type>
+    <number type="integer">3962</number>
+    <session type="integer">111</session>
+    <introduced type="integer">1256270400</introduced>
+    <is-major type="boolean">false</is-major>
+  </bill>
+</bills>'''
+
+
+PEOPLE_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<people type="array">
+  <person>
+    <person-id type="integer">412378</person-id>
+    <firstname>Al</firstname>
+    <lastname>Franken</lastname>
+    <gender>M</gender>
+    <state>MN</state>
+    <party>Democrat</party>
+    <user-approval type="float">7.5</user-approval>
+  </person>
+  <person>
+    <person-id type="integer">400068</person-id>
+    <firstname>Keith</firstname>
+    <lastname>Ellison</lastname>
+    <gender>M</gender>
+    <state>MN</state>
+    <district type="integer">5</district>
+    <party>Democrat</party>
+    <user-approval type="float">6.0</user-approval>
+  </person>
+  <person>
+    <person-id type="integer">412385</person-id>
+    <firstname>Erik</firstname>
+    <lastname>Paulsen</lastname>
+    <gender>M</gender>
+    <state>MN</state>
+    <district type="integer">3</district>
+    <party>Republican</party>
+    <user-approval type="float">4.0</user-approval>
+  </person>
+</people>'''
+
+
+def parse_bills(xml=BILLS_XML, lazy=False):
+    """
+    Returns the Bills parsed from a bills document.
+    """
+    from xml.etree import ElementTree
+    return [opencongress.classes.Bill(elem, lazy) for elem in \
+        ElementTree.fromstring(xml).findall('bill')]
+
+
+class FixtureAsyncApi(opencongress.AsyncApi):
+    """
+    An AsyncApi that connects to a FixtureServer, whichever host a request
+    is for.
+    """
+    def __init__(self, server, *args, **kwargs):
+        super(FixtureAsyncApi, self).__init__(*args, **kwargs)
+        self.server = server
+    
+    def _address(self, netloc):
+        return self.server.server_address
+
+
+class FixtureTestCase(unittest.TestCase):
+    """
+    Runs each test against a FixtureServer serving fixtures(), with an Api
+    (self.api) whose requests go to it.
+    """
+    
+    def fixtures(self):
+        return {'/api/bills': BILLS_XML}
+    
+    def setUp(self):
+        self.server = FixtureServer(self.fixtures())
+        self.addCleanup(self.server.shutdown)
+        self.api = self.make_api()
+    
+    def make_api(self, **kwargs):
+        """
+        Returns an Api that sends its requests to the fixture server, and
+        closes its connections once the test is over.
+        """
+        api = opencongress.Api(API_KEY, **kwargs)
+        api.pool.close()
+        api.pool = FixtureTransport(self.server)
+        self.addCleanup(api.pool.close)
+        return api
+    
+    def make_async_api(self, **kwargs):
+        """
+        Returns an AsyncApi that connects to the fixture server.
+        """
+        return FixtureAsyncApi(self.server, API_KEY, **kwargs)
+
+
+class Transport(unittest.TestCase):
+    
+    def setUp(self):
+        self.server = FixtureServer({'/api/people': '<people></people>'})
+        self.pool = opencongress.transport.ConnectionPool(maxsize=2)
+    
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+    
+    def test_connection_reused(self):
+        for i in range(3):
+            response = self.pool.urlopen(self.server.url + '/api/people')
+            self.assertEqual(response.read(), '<people></people>')
+            response.close()
+        self.assertEqual(
+            self.pool.stats(),
+            {'open': 1, 'idle': 1, 'reused': 2}
+        )
+    
+    def test_unread_response_not_reused(self):
+        response = self.pool.urlopen(self.server.url + '/api/people')
+        response.close()
+        self.assertEqual(
+            self.pool.stats(),
+            {'open': 0, 'idle': 0, 'reused': 0}
+        )
+
+
+class Streaming(FixtureTestCase):
+    
+    def test_iter_bills(self):
+        bills = self.api.iter_bills(congress=111)
+        first = bills.next()
+        self.assertIsInstance(first, opencongress.classes.Bill)
+        self.assertEqual(first.id, 57656)
+        self.assertEqual([bill.id for bill in bills], [60845])
+    
+    def test_iter_bills_matches_bills(self):
+        self.assertEqual(
+            [repr(vars(bill)) for bill in self.api.iter_bills()],
+            [repr(vars(bill)) for bill in self.api.bills()]
+        )
+    
+    def test_iter_bills_invalid_argument(self):
+        def invalidArgument():
+            self.api.iter_bills(type='zz')
+        self.assertRaises(
+            opencongress.exceptions.ArgumentError,
+            invalidArgument
+        )
+
+
+class AsyncApiMethods(FixtureTestCase):
+    
+    def setUp(self):
+        super(AsyncApiMethods, self).setUp()
+        self.api = self.make_async_api()
+    
+    def test_bills(self):
+        pending = [self.api.bills(congress=111) for i in range(5)]
+        self.assertFalse(pending[0].done())
+        self.api.wait()
+        for result in pending:
+            self.assertEqual([bill.id for bill in result.result()], \
+                [57656, 60845])
+    
+    def test_http_error(self):
+        result = self.api.hot_bills()
+        self.assertRaises(opencongress.exceptions.HTTPError, result.result)
+    
+    def test_invalid_argument(self):
+        def invalidArgument():
+            self.api.bills(type='zz')
+        self.assertRaises(
+            opencongress.exceptions.ArgumentError,
+            invalidArgument
+        )
+    
+    def test_paging(self):
+        self.assertRaises(
+            opencongress.exceptions.ArgumentError,
+            self.api.iter_battle_royale,
+            'bills'
+        )
+    
+    def test_threaded_methods(self):
+        for method, args in [
+            (self.api.pipeline, (['bills'],)),
+            (self.api.to_columns, ('bills',)),
+            (self.api.to_records, ('bills',)),
+        ]:
+            self.assertRaises(opencongress.exceptions.ArgumentError, \
+                method, *args)
+        self.assertEqual(self.server.requests, [])
+    
+    def test_batch(self):
+        results = self.api.batch([
+            ('bills', {'congress': 111}),
+            'hot_bills',
+            ('bills', {'type': 'zz'}),
+            'no_such_method',
+        ], max_workers=2)
+        self.assertEqual([bill.id for bill in results[0].results], \
+            [57656, 60845])
+        self.assertIsInstance(
+            results[1].error,
+            opencongress.exceptions.HTTPError
+        )
+        self.assertIsInstance(
+            results[2].error,
+            opencongress.exceptions.ArgumentError
+        )
+        self.assertIsInstance(
+            results[3].error,
+            opencongress.exceptions.ArgumentError
+        )
+        results = list(self.api.batch(['bills'] * 4, ordered=False))
+        self.assertEqual([[bill.id for bill in result.results] \
+            for result in results], [[57656, 60845]] * 4)
+    
+    def test_throttle(self):
+        self.assertRaises(ValueError, self.make_async_api, \
+            throttle=opencongress.transport.Throttle(rate=5))
+        self.assertRaises(ValueError, self.make_async_api, maxsize=8)
+    
+    def test_timeout(self):
+        api = self.make_async_api(timeout=0.2)
+        self.server.delay = 1
+        result = api.bills()
+        started = time.time()
+        api.wait()
+        self.assertLess(time.time() - started, 0.9)
+        self.assertIsInstance(result.exception(), socket.timeout)
+        self.assertEqual(api.stats()['async']['in_flight'], 0)
+    
+    def test_validators(self):
+        api = self.make_async_api(validators= \
+            opencongress.cache.ValidatorCache())
+        first = api.bills().result()
+        second = api.bills().result()
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIs(first[0], second[0])
+        self.assertEqual(api.stats()['validators'], \
+            {'entries': 1, 'not_modified': 1})
+    
+    def test_coalesce(self):
+        pending = [self.api.bills() for i in range(3)]
+        self.api.wait()
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual([[bill.id for bill in result.result()] \
+            for result in pending], [[57656, 60845]] * 3)
+        self.assertEqual(self.api.stats()['flights'], \
+            {'in_flight': 0, 'coalesced': 2})
+        api = self.make_async_api(coalesce=False)
+        api.wait([api.bills(), api.bills()])
+        self.assertEqual(len(self.server.requests), 3)
+
+
+class Batch(FixtureTestCase):
+    
+    def test_batch_ordered(self):
+        results = self.api.batch([
+            ('bills', {'congress': 111}),
+            'hot_bills',
+            ('bills', {'type': 'zz'}),
+        ], max_workers=3)
+        self.assertEqual([bill.id for bill in results[0].results], \
+            [57656, 60845])
+        self.assertIsInstance(
+            results[1].error,
+            opencongress.exceptions.HTTPError
+        )
+        self.assertIsInstance(
+            results[2].error,
+            opencongress.exceptions.ArgumentError
+        )
+    
+    def test_batch_as_completed(self):
+        threads = threading.active_count()
+        results = self.api.batch(['bills'] * 4, ordered=False)
+        self.assertEqual(threading.active_count(), threads)
+        results = list(results)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(result.ok for result in results))
+    
+    def test_batch_invalid_method(self):
+        results = self.api.batch(['no_such_method', '_call', 'bills'])
+        for result in results[:2]:
+            self.assertIsInstance(
+                result.error,
+                opencongress.exceptions.ArgumentError
+            )
+        self.assertEqual([bill.id for bill in results[2].results], \
+            [57656, 60845])
+        results = list(self.api.pipeline(['no_such_method', 'bills']))
+        self.assertIsInstance(
+            results[0].error,
+            opencongress.exceptions.ArgumentError
+        )
+        self.assertTrue(results[1].ok)
+
+
+class Cache(FixtureTestCase):
+    
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        super(Cache, self).setUp()
+    
+    def make_api(self, **kwargs):
+        return super(Cache, self).make_api(cache=self.path, **kwargs)
+    
+    def test_cached_response(self):
+        first = self.api.bills(congress=110)
+        other = opencongress.Api('another_key', cache=self.path)
+        other.pool = self.api.pool
+        second = other.bills(congress=110)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(
+            [repr(vars(bill)) for bill in first],
+            [repr(vars(bill)) for bill in second]
+        )
+        self.assertEqual(other.stats()['cache'], {'hits': 1, 'misses': 0})
+    
+    def test_ttl_expiry(self):
+        self.api.cache.ttls['Bills'] = 0
+        self.api.bills(congress=110)
+        self.api.bills(congress=110)
+        self.assertEqual(len(self.server.requests), 2)
+    
+    def test_ttls(self):
+        this_week = opencongress.calls.HotBills(API_KEY, fetch=False)
+        past = opencongress.calls.Bills(API_KEY, congress=110, fetch=False)
+        self.assertTrue(this_week.cache_ttl() < past.cache_ttl())
+    
+    def test_eviction(self):
+        cache = opencongress.cache.DiskCache(self.path, max_size=1000)
+        for i in range(5):
+            cache.set('http://example.com/%s' % i, {}, 'x' * 400)
+        self.assertEqual(len(os.listdir(self.path)), 2)
+        self.assertEqual(cache.get('http://example.com/4', 60), \
+            ({}, 'x' * 400))
+        self.assertEqual(cache.get('http://example.com/0', 60), None)
+    
+    def test_store_stream(self):
+        class Body(object):
+            # A response body that may only be read in chunks
+            def __init__(self, data):
+                self.fp = StringIO.StringIO(data)
+                self.reads = []
+            def read(self, amt=None):
+                self.reads.append(amt)
+                return self.fp.read(amt)
+        cache = opencongress.cache.DiskCache(self.path)
+        data = 'x' * (1024 * 1024)
+        body = Body(data)
+        stored = cache.set_stream('http://example.com/', {'etag': '1'}, body)
+        try:
+            self.assertEqual(stored.read(), data)
+        finally:
+            stored.close()
+        self.assertTrue(len(body.reads) > 1 and None not in body.reads)
+        self.assertEqual(cache.get('http://example.com/', 60), \
+            ({'etag': '1'}, data))
+
+
+class ResultsCache(FixtureTestCase):
+    
+    def make_api(self, **kwargs):
+        return super(ResultsCache, self).make_api(results_cache= \
+            opencongress.cache.ResultCache(max_entries=2), **kwargs)
+    
+    def test_cached_results(self):
+        first = self.api.bills(congress=111, type='h')
+        second = self.api.bills(type='h', congress=111)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertIsNot(first, second)
+        self.assertIs(first[0], second[0])
+        stats = self.api.stats()['results_cache']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['bytes'], len(BILLS_XML))
+    
+    def test_copies(self):
+        # Lists handed out may be changed freely; the objects in them are
+        # shared and read-only
+        first = self.api.bills(congress=111)
+        first.pop()
+        second = self.api.bills(congress=111)
+        self.assertEqual([bill.id for bill in second], [57656, 60845])
+        cache = opencongress.cache.ResultCache()
+        cache.set('key', opencongress.calls.IdentResults(['bill'], \
+            ['111-h1']), 60, 0)
+        cache.get('key').missing.append('111-h2')
+        self.assertEqual(cache.get('key').missing, ['111-h1'])
+    
+    def test_lru_eviction(self):
+        for congress in (109, 110, 111, 109):
+            self.api.bills(congress=congress)
+        self.assertEqual(len(self.server.requests), 4)
+        self.api.bills(congress=111)
+        self.assertEqual(len(self.server.requests), 4)
+    
+    def test_ttl_expiry(self):
+        self.api.results_cache.ttl = -1
+        self.api.bills()
+        self.api.bills()
+        self.assertEqual(len(self.server.requests), 2)
+
+
+class Revalidation(FixtureTestCase):
+    
+    def fixtures(self):
+        return {'/api/most_tracked_bills_this_week': BILLS_XML}
+    
+    def make_api(self, **kwargs):
+        return super(Revalidation, self).make_api(validators= \
+            opencongress.cache.ValidatorCache(), **kwargs)
+    
+    def test_not_modified(self):
+        first = self.api.most_tracked_bills_this_week()
+        second = self.api.most_tracked_bills_this_week()
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIs(first[0], second[0])
+        self.assertEqual(self.api.stats()['validators'], \
+            {'entries': 1, 'not_modified': 1})
+        self.assertEqual(self.api.pool.stats()['open'], 1)
+    
+    def test_modified(self):
+        self.api.most_tracked_bills_this_week()
+        self.server.fixtures['/api/most_tracked_bills_this_week'] = \
+            BILLS_XML.replace('57656', '1')
+        results = self.api.most_tracked_bills_this_week()
+        self.assertEqual(results[0].id, 1)
+        self.assertEqual(self.api.stats()['validators']['not_modified'], 0)
+
+
+class Gzip(FixtureTestCase):
+    
+    def setUp(self):
+        super(Gzip, self).setUp()
+        self.server.gzip = True
+    
+    def test_gzipped_response(self):
+        self.assertEqual([bill.id for bill in self.api.bills()], \
+            [57656, 60845])
+        self.assertEqual([bill.id for bill in self.api.iter_bills()], \
+            [57656, 60845])
+    
+    def test_decoding_reader(self):
+        for data in (BILLS_XML, gzip_string(BILLS_XML)):
+            reader = opencongress.transport.DecodingReader( \
+                StringIO.StringIO(data), chunk_size=7)
+            chunks = []
+            while True:
+                chunk = reader.read(100)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            self.assertEqual(''.join(chunks), BILLS_XML)
+
+
+class Nodes(unittest.TestCase):
+    
+    def setUp(self):
+        self.bills = parse_bills()
+    
+    def test_slots(self):
+        bill = self.bills[0]
+        self.assertFalse(hasattr(opencongress.classes.Bill, '__weakref__'))
+        self.assertEqual(bill.title_full_common, \
+            'H.R.2454 American Clean Energy and Security Act of 2009')
+        self.assertEqual(str(self.bills[1]), 'H.3962')
+        self.assertEqual(vars(bill)['number'], 2454)
+    
+    def test_overflow(self):
+        bill = self.bills[0]
+        bill.annotation = 'x'
+        self.assertEqual(bill.annotation, 'x')
+        self.assertEqual(vars(bill)['annotation'], 'x')
+        self.assertRaises(AttributeError, getattr, bill, 'no_such_field')
+    
+    def test_lazy(self):
+        decoded = []
+        def number(elem):
+            decoded.append(elem.text)
+            return int(elem.text)
+        opencongress.classes.register_tag('number', number)
+        try:
+            bill = parse_bills(lazy=True)[0]
+            self.assertTrue('updated' in dir(bill))
+            self.assertEqual(decoded, [])
+            self.assertEqual(bill.number, 2454)
+            self.assertEqual(bill.number, 2454)
+            self.assertEqual(decoded, ['2454'])
+        finally:
+            del opencongress.classes.TAG_CONVERTERS['number']
+        eager = self.bills[0]
+        self.assertEqual(str(bill), str(eager))
+        self.assertEqual(repr(sorted(vars(bill).items())), \
+            repr(sorted(vars(eager).items())))
+    
+    def test_pickle(self):
+        import pickle
+        bill = pickle.loads(pickle.dumps(self.bills[0], 2))
+        self.assertEqual(repr(vars(bill)), repr(vars(self.bills[0])))
+
+
+class Deserialize(unittest.TestCase):
+    
+    def deserialize(self, xml):
+        from xml.etree import ElementTree
+        return opencongress.classes.deserialize(ElementTree.fromstring(xml))
+    
+    def test_types(self):
+        self.assertEqual(self.deserialize('<a type="integer">3</a>'), 3)
+        self.assertEqual(self.deserialize('<a type="boolean">true</a>'), True)
+        self.assertEqual(self.deserialize('<a nil="true" type="float"/>'), \
+            0.0)
+        self.assertEqual(self.deserialize('<a nil="true"/>'), None)
+        self.assertEqual(self.deserialize('<a type="unknown">3</a>'), None)
+        self.assertEqual(self.deserialize('<a><b-c>d</b-c></a>'), \
+            {'b_c': 'd'})
+        self.assertEqual(self.deserialize("<fti-names>'a':1,3</fti-names>"), \
+            {'a': [1, 3]})
+    
+    def test_timestamp(self):
+        import datetime
+        value = self.deserialize( \
+            '<a type="timestamp">Fri Jun 26 19:52:03 -0400 2009</a>')
+        self.assertEqual(value.utcoffset(), datetime.timedelta(hours=-4))
+        self.assertEqual(
+            value.astimezone(opencongress.classes.FixedOffset(0)).hour,
+            23
+        )
+        self.assertEqual(self.deserialize('<a type="date">2009-06-26</a>'), \
+            datetime.date(2009, 6, 26))
+    
+    def test_postings(self):
+        postings = self.deserialize( \
+            "<fti-titles>'d':4 'ca':5 'diann':2,6,8 'feinstein':3,7,9" \
+            "</fti-titles>")
+        self.assertIsInstance(postings, opencongress.classes.Postings)
+        self.assertEqual(postings['diann'], [2, 6, 8])
+        self.assertEqual(postings.keys(), ['ca', 'd', 'diann', 'feinstein'])
+        self.assertTrue('ca' in postings)
+        self.assertFalse('sen' in postings)
+        self.assertRaises(KeyError, lambda: postings['sen'])
+        self.assertEqual(list(postings.offsets), [0, 1, 2, 5, 8])
+    
+    def test_register_type(self):
+        import decimal
+        opencongress.classes.register_type('decimal', \
+            lambda elem: decimal.Decimal(elem.text))
+        try:
+            self.assertEqual(self.deserialize('<a type="decimal">1.5</a>'), \
+                decimal.Decimal('1.5'))
+        finally:
+            del opencongress.classes.TYPE_CONVERTERS['decimal']
+
+
+class Search(unittest.TestCase):
+    
+    def setUp(self):
+        self.bills = parse_bills()
+        self.bills[1].title_full_common = 'H.R.3962 Affordable Health Care ' \
+            'for America Act'
+        self.index = opencongress.search.BillIndex()
+        self.index.add(self.bills)
+    
+    def ids(self, query):
+        return [bill.id for bill in self.index.search(query)]
+    
+    def test_terms(self):
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.ids('Clean security'), [57656])
+        self.assertEqual(sorted(self.ids('act')), [57656, 60845])
+        self.assertEqual(self.ids('energi'), [57656])
+        self.assertEqual(self.ids('clean health'), [])
+        self.assertRaises(opencongress.exceptions.ArgumentError, \
+            self.index.search, '" "')
+    
+    def test_phrase_and_prefix(self):
+        self.assertEqual(self.ids('"health care"'), [60845])
+        self.assertEqual(self.ids('"care health"'), [])
+        self.assertEqual(self.ids('"american clean"'), [57656])
+        self.assertEqual(self.ids('afford*'), [60845])
+        self.assertEqual(len(self.index.search('a*', limit=1)), 1)
+    
+    def test_replace(self):
+        self.bills[1].title_full_common = 'H.R.3962 Clean Water Act'
+        self.index.add([self.bills[1]])
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.ids('health'), [])
+        self.assertEqual(sorted(self.ids('clean')), [57656, 60845])
+    
+    def test_replace_scores(self):
+        scored = [(bill.id, score) for bill, score in \
+            self.index.scored('act')]
+        for i in range(10):
+            self.index.add([self.bills[1]])
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual([(bill.id, score) for bill, score in \
+            self.index.scored('act')], scored)
+        self.assertTrue(all(score > 0 for bill_id, score in scored))
+    
+    def test_save_load(self):
+        path = os.path.join(tempfile.mkdtemp(), 'bills.index')
+        try:
+            self.index.save(path)
+            index = opencongress.search.BillIndex.load(path)
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+        self.assertEqual([bill.id for bill in index.search('"health care"')], \
+            [60845])
+        self.assertEqual(len(index), 2)
+    
+    def test_api(self):
+        api = opencongress.Api('test_key', search_index=self.index)
+        self.assertEqual([bill.id for bill in \
+            api.bills_by_query('secur*', local=True)], [57656])
+        self.assertRaises(opencongress.exceptions.ArgumentError, \
+            opencongress.Api('test_key').bills_by_query, 'clean', local=True)
+    
+    def test_async_api(self):
+        api = opencongress.AsyncApi('test_key', search_index=self.index)
+        result = api.bills_by_query('secur*', local=True)
+        self.assertTrue(result.done())
+        self.assertEqual([bill.id for bill in result.result()], [57656])
+        self.assertRaises(opencongress.exceptions.ArgumentError, \
+            opencongress.AsyncApi('test_key').bills_by_query, 'clean', \
+            local=True)
+
+
+class Paging(FixtureTestCase):
+    
+    def fixtures(self):
+        def page(query):
+            number = int(query['page'][0])
+            if number > 3:
+                return '<bills type="array"></bills>'
+            return '<bills type="array"><bill><id type="integer">%s</id>' \
+                '</bill></bills>' % number
+        return {'/battle_royale.xml': page}
+    
+    def test_pages(self):
+        results = self.api.iter_battle_royale('bills', timeframe='1day', \
+            prefetch=2)
+        self.assertEqual([bill.id for bill in results], [1, 2, 3])
+        self.assertEqual(results.stats()['pages'], 4)
+        self.assertTrue(results.stats()['waited'] >= 0)
+    
+    def test_start_page(self):
+        results = self.api.iter_battle_royale('bills', page=3, prefetch=0)
+        self.assertEqual([bill.id for bill in results], [3])
+        self.assertEqual(len(self.server.requests), 2)
+    
+    def test_invalid(self):
+        self.assertRaises(
+            opencongress.exceptions.ArgumentError,
+            self.api.iter_battle_royale,
+            'bills',
+            timeframe='2days'
+        )
+
+
+class Pipelining(FixtureTestCase):
+    
+    def setUp(self):
+        super(Pipelining, self).setUp()
+        self.server.gzip = True
+    
+    def test_ordered(self):
+        results = self.api.pipeline([
+            ('bills', {'congress': 111}),
+            'hot_bills',
+            ('bills', {'type': 'zz'}),
+            ('bills', {'congress': 110}),
+        ], fetch_workers=2, queue_size=1)
+        results = list(results)
+        self.assertEqual([bill.id for bill in results[0].results], \
+            [57656, 60845])
+        self.assertIsInstance(
+            results[1].error,
+            opencongress.exceptions.HTTPError
+        )
+        self.assertIsInstance(
+            results[2].error,
+            opencongress.exceptions.ArgumentError
+        )
+        self.assertEqual(results[3].kwargs, {'congress': 110})
+        self.assertEqual(sorted(results[0].results[0].fti_titles.keys()), \
+            ['clean', 'energi', 'secur'])
+    
+    def test_unordered(self):
+        self.api.results_cache = opencongress.cache.ResultCache()
+        results = self.api.pipeline(['bills'] * 4, ordered=False)
+        self.assertEqual(len(list(results)), 4)
+        self.assertEqual(sorted(results.stats().keys()), \
+            ['fetch_time', 'parse_time', 'wall_time'])
+        requests = len(self.server.requests)
+        self.assertEqual(len(list(self.api.pipeline(['bills'] * 2))), 2)
+        self.assertEqual(len(self.server.requests), requests)
+    
+    def test_unbuildable(self):
+        results = list(self.api.pipeline([
+            ('compare_many', [[300001, 300013]]),
+            ('iter_bills', {'congress': 111}),
+        ]))
+        self.assertTrue(all(isinstance(result.error, \
+            opencongress.exceptions.ArgumentError) for result in results))
+        self.assertRaises(
+            opencongress.exceptions.ArgumentError,
+            self.api.to_columns,
+            'batch',
+            ['bills']
+        )
+        self.assertEqual(len(self.server.requests), 0)
+    
+    def test_workers_stop(self):
+        threads = threading.active_count()
+        results = self.api.pipeline(['bills'] * 4, fetch_workers=2)
+        self.assertEqual(threading.active_count(), threads)
+        self.assertTrue(next(results).ok)
+        self.assertTrue(threading.active_count() > threads)
+        # Abandoning the pipeline part-way stops its workers
+        del results
+        deadline = time.time() + 5
+        while threading.active_count() > threads and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(threading.active_count(), threads)
+
+
+class BillsByIdent(FixtureTestCase):
+    
+    def fixtures(self):
+        def bills(query):
+            return '<bills type="array">%s</bills>' % ''.join(
+                '<bill><ident>%s</ident></bill>' % ident \
+                for ident in query['ident[]'] if not ident.endswith('0'))
+        return {'/api/bills_by_ident': bills}
+    
+    def test_single_request(self):
+        bills = self.api.bills_by_ident('111-h3', '111-h10', '111-h2', \
+            '111-h3')
+        self.assertEqual([bill.ident for bill in bills], ['111-h3', '111-h2'])
+        self.assertEqual(bills.missing, ['111-h10'])
+        self.assertEqual(len(self.server.requests), 1)
+    
+    def test_results_cache(self):
+        # Idents asked for in another order make another call
+        api = self.make_api(results_cache=opencongress.cache.ResultCache())
+        first = api.bills_by_ident('111-h1', '111-h2')
+        second = api.bills_by_ident('111-h2', '111-h1')
+        self.assertEqual([bill.ident for bill in first], ['111-h1', '111-h2'])
+        self.assertEqual([bill.ident for bill in second], \
+            ['111-h2', '111-h1'])
+        api.bills_by_ident('111-h1', '111-h2')
+        self.assertEqual(len(self.server.requests), 2)
+    
+    def test_chunks(self):
+        idents = ['111-h%s' % i for i in range(1, 50)]
+        self.assertEqual(len(list( \
+            opencongress.calls.BillsByIdent.chunks(idents))), 1)
+        
+        idents = ['111-h%s' % i for i in range(1, 300)]
+        chunks = list(opencongress.calls.BillsByIdent.chunks(idents))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(sum(chunks, []), idents)
+        bills = self.api.bills_by_ident(*(idents + idents[:5]))
+        self.assertEqual(len(self.server.requests), len(chunks))
+        self.assertEqual([bill.ident for bill in bills], \
+            [ident for ident in idents if not ident.endswith('0')])
+        self.assertEqual(bills.missing, \
+            [ident for ident in idents if ident.endswith('0')])
+    
+    # Enough idents for several requests
+    idents = ['111-h%s' % i for i in range(1, 300)]
+    
+    def found(self):
+        return [ident for ident in self.idents if not ident.endswith('0')]
+    
+    def test_pipeline(self):
+        results = list(self.api.pipeline([
+            ['bills_by_ident', self.idents],
+            ['bills_by_ident', self.idents[:3]],
+        ]))
+        self.assertTrue(len(self.server.requests) > 2)
+        self.assertEqual([bill.ident for bill in results[0].results], \
+            self.found())
+        self.assertEqual(len(results[0].results.missing), 29)
+        self.assertEqual([bill.ident for bill in results[1].results], \
+            self.idents[:3])
+    
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_columns(self):
+        columns = self.api.to_columns('bills_by_ident', *self.idents)
+        self.assertTrue(len(self.server.requests) > 1)
+        self.assertEqual(sorted(columns['ident']), sorted(self.found()))
+    
+    def test_async(self):
+        api = self.make_async_api()
+        pending = api.bills_by_ident(*self.idents)
+        bills = pending.result(timeout=10)
+        self.assertTrue(len(self.server.requests) > 1)
+        self.assertEqual([bill.ident for bill in bills], self.found())
+        self.assertEqual(len(bills.missing), 29)
+    
+        self.server.fixtures['/api/bills_by_ident'] = ''
+        pending = api.bills_by_ident(*self.idents)
+        self.assertRaises(opencongress.exceptions.HTTPError, pending.result, \
+            10)
+
+
+class Throttling(FixtureTestCase):
+    
+    def fixtures(self):
+        self.statuses = []
+        def bills(query):
+            if self.statuses:
+                return self.statuses.pop(0), ''
+            return BILLS_XML
+        return {'/api/bills': bills}
+    
+    def make_throttled_api(self, **kwargs):
+        self.throttle = opencongress.transport.Throttle(**kwargs)
+        self.api = self.make_api(throttle=self.throttle)
+    
+    def test_retry(self):
+        self.make_throttled_api(retries=3, backoff=0.01, max_concurrency=4)
+        self.statuses = [503, 500]
+        self.assertEqual(len(self.api.bills()), 2)
+        stats = self.api.stats()['throttle']
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['failures'], 2)
+        self.assertEqual(stats['active'], 0)
+        # Halved twice, then raised by one
+        self.assertEqual(stats['concurrency'], 2)
+    
+    def test_give_up(self):
+        self.make_throttled_api(retries=1, backoff=0.01)
+        self.statuses = [503, 503, 503]
+        try:
+            self.api.bills()
+        except opencongress.exceptions.HTTPError as e:
+            self.assertEqual(e.code, 503)
+        else:
+            self.fail('HTTPError not raised')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.statuses, [503])
+    
+    def test_not_retryable(self):
+        self.make_throttled_api(retries=3, backoff=0.01)
+        self.statuses = [404]
+        self.assertRaises(opencongress.exceptions.HTTPError, self.api.bills)
+        self.assertEqual(self.throttle.stats()['retries'], 0)
+    
+    def test_rate(self):
+        self.make_throttled_api(rate=20, burst=1)
+        started = time.time()
+        for i in range(4):
+            self.api.bills(congress=100 + i)
+        self.assertTrue(time.time() - started >= 0.14)
+        self.assertTrue(self.throttle.stats()['waited'] > 0)
+
+
+class Coalescing(FixtureTestCase):
+    
+    def fixtures(self):
+        def bills_by_ident(query):
+            return '<bills type="array">%s</bills>' % ''.join(
+                '<bill><ident>%s</ident></bill>' % ident \
+                for ident in query['ident[]'])
+        return {
+            '/api/bills': BILLS_XML,
+            '/api/bills_by_ident': bills_by_ident,
+        }
+    
+    def setUp(self):
+        super(Coalescing, self).setUp()
+        self.server.delay = 0.3
+    
+    def run_threads(self, function, count=5):
+        results = []
+        def target():
+            try:
+                results.append(function())
+            except Exception as e:
+                results.append(e)
+        threads = [threading.Thread(target=target) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+    
+    def test_single_flight(self):
+        flights = opencongress.cache.SingleFlight()
+        release = threading.Event()
+        def function():
+            release.wait()
+            return [1]
+        def waiter():
+            while flights.stats()['coalesced'] < 4:
+                time.sleep(0.01)
+            release.set()
+        threading.Thread(target=waiter).start()
+        results = self.run_threads(lambda: flights.do('key', function))
+        self.assertEqual(results, [[1]] * 5)
+        self.assertEqual(flights.stats(), {'in_flight': 0, 'coalesced': 4})
+    
+    def test_api(self):
+        results = self.run_threads(self.api.bills)
+        self.assertEqual([len(bills) for bills in results], [2] * 5)
+        self.assertTrue(len(self.server.requests) < 5)
+        self.assertEqual(self.api.stats()['flights']['coalesced'], \
+            5 - len(self.server.requests))
+    
+    def test_errors(self):
+        results = self.run_threads(self.api.hot_bills)
+        self.assertTrue(all(isinstance(result, \
+            opencongress.exceptions.HTTPError) for result in results))
+        self.assertTrue(len(self.server.requests) < 5)
+    
+    def test_ident_order(self):
+        # Calls for the same idents in another order are not coalesced
+        orders = iter([('111-h1', '111-h2'), ('111-h2', '111-h1')] * 2)
+        results = self.run_threads(lambda: [bill.ident for bill in \
+            self.api.bills_by_ident(*next(orders))], count=4)
+        self.assertEqual(sorted(results), [['111-h1', '111-h2']] * 2 + \
+            [['111-h2', '111-h1']] * 2)
+        self.assertTrue(len(self.server.requests) >= 2)
+    
+    def test_disabled(self):
+        api = self.make_api(coalesce=False)
+        self.assertFalse('flights' in api.stats())
+        self.assertEqual(len(api.bills()), 2)
+
+
+class Mirror(FixtureTestCase):
+    
+    def fixtures(self):
+        self.since = []
+        self.full_page = False
+        def introduced_since(query):
+            self.since.append(query['date'][0])
+            if self.full_page:
+                return '<bills type="array">%s</bills>' % ''.join(
+                    '<bill><id type="integer">%d</id>'
+                    '<session type="integer">111</session>'
+                    '<introduced type="integer">1256961600</introduced>'
+                    '</bill>' % (70000 + i) for i in range(30))
+            return """<bills type="array">
+              <bill>
+                <id type="integer">60845</id>
+                <ident>111-h3962</ident>
+                <session type="integer">111</session>
+                <introduced type="integer">1256270400</introduced>
+                <title-common>Affordable Health Care for America Act</title-common>
+              </bill>
+              <bill>
+                <id type="integer">61000</id>
+                <ident>111-s1733</ident>
+                <bill-type>s</bill-type>
+                <session type="integer">111</session>
+                <introduced type="integer">1256961600</introduced>
+              </bill>
+            </bills>"""
+        return {
+            '/api/bills': BILLS_XML,
+            '/api/bills_introduced_since': introduced_since,
+        }
+    
+    def setUp(self):
+        super(Mirror, self).setUp()
+        self.mirror = opencongress.mirror.BillMirror(self.api, ':memory:')
+        self.addCleanup(self.mirror.close)
+    
+    def test_load_and_sync(self):
+        import datetime
+        self.assertEqual(self.mirror.load(congress=111), 2)
+        self.assertEqual(len(self.mirror), 2)
+        self.assertEqual(self.mirror.high_water, datetime.date(2009, 10, 23))
+        bill = self.mirror.bills()[0]
+        self.assertEqual(bill.title_full_common, \
+            'H.R.2454 American Clean Energy and Security Act of 2009')
+        self.assertEqual(bill.fti_titles['clean'], [2, 7])
+        
+        self.assertEqual(self.mirror.sync(), 2)
+        self.assertEqual(self.since, ['Oct 23rd, 2009'])
+        self.assertEqual(len(self.mirror), 3)
+        self.assertEqual(self.mirror.get('111-H3962').title_common, \
+            'Affordable Health Care for America Act')
+        self.assertEqual([bill.id for bill in \
+            self.mirror.bills(bill_type='s')], [61000])
+        self.assertEqual(self.mirror.high_water, datetime.date(2009, 10, 31))
+        self.assertEqual(self.mirror.get('111-h1'), None)
+    
+    def test_full_page(self):
+        import datetime
+        self.full_page = True
+        self.assertEqual(self.mirror.sync(), 2)
+        self.assertEqual(self.server.requests[-1], \
+            '/api/bills?congress=111&key=%s' % API_KEY)
+        self.assertEqual(sorted(bill.id for bill in self.mirror.bills()), \
+            [57656, 60845])
+        self.assertEqual(self.mirror.high_water, datetime.date(2009, 10, 23))
+
+
+class PeopleIndex(FixtureTestCase):
+    
+    def fixtures(self):
+        return {'/api/people': PEOPLE_XML}
+    
+    def names(self, **kwargs):
+        return [person.lastname for person in \
+            self.api.people(local=True, **kwargs)]
+    
+    def test_filters(self):
+        self.assertEqual(self.names(state='MN', party='Democrat'), \
+            ['Franken', 'Ellison'])
+        self.assertEqual(self.names(first_name='erik'), ['Paulsen'])
+        self.assertEqual(self.names(district='5'), ['Ellison'])
+        self.assertEqual(self.names(person_id=412378), ['Franken'])
+        self.assertEqual(self.names(state='AZ'), [])
+        self.assertEqual(len(self.names()), 3)
+        self.assertEqual(len(self.server.requests), 1)
+    
+    def test_approval(self):
+        self.assertEqual(self.names(user_approval=(7.5, 5)), \
+            ['Franken', 'Ellison'])
+        self.assertEqual(self.names(user_approval=(0, 5), party='Democrat'), \
+            [])
+    
+    def test_validation(self):
+        self.assertRaises(
+            opencongress.exceptions.ArgumentError,
+            self.names,
+            state='mn'
+        )
+        self.assertRaises(
+            opencongress.exceptions.ArgumentError,
+            self.names,
+            nickname='Al'
+        )
+    
+    def test_pipeline(self):
+        results = list(self.api.pipeline([
+            ('people', {'local': True, 'state': 'MN', 'party': 'Democrat'}),
+            ('people', {'local': True, 'state': 'mn'}),
+        ]))
+        self.assertEqual([person.lastname for person in results[0].results], \
+            ['Franken', 'Ellison'])
+        self.assertIsInstance(
+            results[1].error,
+            opencongress.exceptions.ArgumentError
+        )
+        self.assertEqual(len(self.server.requests), 1)
+    
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_columns(self):
+        columns = self.api.to_columns('people', local=True, state='MN', \
+            fields=['lastname'])
+        self.assertEqual(list(columns['lastname']), \
+            ['Franken', 'Ellison', 'Paulsen'])
+    
+    def test_async(self):
+        api = self.make_async_api()
+        pending = api.people(local=True, state='MN', party='Democrat')
+        self.assertEqual([person.lastname for person in pending.result()], \
+            ['Franken', 'Ellison'])
+        pending = api.people(local=True, first_name='erik')
+        self.assertEqual([person.lastname for person in pending.result()], \
+            ['Paulsen'])
+        self.assertRaises(opencongress.exceptions.ArgumentError, \
+            api.people(local=True, state='mn').result)
+        self.assertEqual(len(self.server.requests), 1)
+
+
+class Columns(FixtureTestCase):
+    
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_fields(self):
+        columns = self.api.to_columns('bills', congress=111, fields=['id', \
+            'updated', 'is_major', 'title_full_common', 'sponsor'])
+        self.assertEqual(list(columns), \
+            ['id', 'title_full_common', 'updated', 'is_major', 'sponsor'])
+        self.assertEqual(list(columns['id']), [57656, 60845])
+        self.assertEqual(columns['is_major'].dtype, numpy.dtype('bool'))
+        self.assertEqual(columns['updated'].dtype, \
+            numpy.dtype('datetime64[s]'))
+        self.assertTrue(numpy.isnat(columns['updated'][1]))
+        self.assertEqual(columns['title_full_common'].dtype, \
+            numpy.dtype(object))
+        self.assertEqual(columns['sponsor'][1], None)
+        
+        columns = opencongress.columns.to_columns(self.api.bills(), \
+            fields=['last_action_at'])
+        self.assertEqual(list(columns), ['last_action_at'])
+        self.assertEqual(str(columns['last_action_at'][0]), '2009-06-26')
+        self.assertTrue(numpy.isnat(columns['last_action_at'][1]))
+    
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_columns(self):
+        columns = self.api.to_columns('bills', categorical=['bill_type'])
+        self.assertEqual(columns['id'].dtype, numpy.dtype('int64'))
+        self.assertEqual(list(columns['is_major']), [True, False])
+        self.assertTrue(numpy.isnat(columns['updated'][1]))
+        self.assertEqual(str(columns['updated'][0]), '2009-06-26T23:52:03')
+        self.assertTrue(numpy.isnan(columns['page_views_count'][1]))
+        self.assertEqual(list(columns['bill_type'].codes), [0, 0])
+        self.assertEqual(columns['sponsor'][0].person_id, 400425)
+        
+        records = opencongress.columns.to_records(self.api.bills(), \
+            fields=['id', 'number'])
+        self.assertEqual(list(records.number), [2454, 3962])
+
+
+class CompareMany(FixtureTestCase):
+    
+    # Each person's votes, by roll call
+    votes = {
+        1: {10: '+', 11: '-', 12: '+'},
+        2: {10: '+', 11: '+', 12: '0'},
+        3: {10: '-', 11: '-', 12: '-'},
+    }
+    
+    def fixtures(self):
+        def compare(query):
+            ids = int(query['person1'][0]), int(query['person2'][0])
+            if 4 in ids:
+                return ''
+            votes = ''.join(
+                '<vote><person1><vote>%s</vote></person1>'
+                '<person2><vote>%s</vote></person2>'
+                '<roll-call><id type="integer">%s</id><question>Q</question>'
+                '</roll-call></vote>' % (self.votes[ids[0]][roll_call], \
+                    self.votes[ids[1]][roll_call], roll_call) \
+                for roll_call in sorted(self.votes[ids[0]]))
+            person = '<person><person-id type="integer">%s</person-id>' \
+                '</person>'
+            return '<comparison><person1>%s</person1><person2>%s</person2>' \
+                '<hot_votes>%s</hot_votes><other_votes></other_votes>' \
+                '</comparison>' % (person % ids[0], person % ids[1], votes)
+        return {'/person/compare.xml': compare}
+    
+    def test_positions(self):
+        self.assertEqual(opencongress.agreement.position('+'), 1)
+        self.assertEqual(opencongress.agreement.position(' Nay'), -1)
+        self.assertEqual(opencongress.agreement.position('P'), 0)
+        self.assertEqual(opencongress.agreement.position(None), 0)
+    
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_matrix(self):
+        matrix = self.api.compare_many([1, 2, 3, 2, 4])
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertEqual(sorted(matrix.errors), [(1, 4), (2, 4), (3, 4)])
+        self.assertEqual(matrix.people, [1, 2, 3, 4])
+        self.assertEqual(matrix.roll_calls, [10, 11, 12])
+        self.assertEqual(matrix.votes.dtype, numpy.dtype('int8'))
+        self.assertEqual(matrix.votes.tolist(), \
+            [[1, -1, 1], [1, 1, 0], [-1, -1, -1], [0, 0, 0]])
+        agreement = matrix.agreement()
+        self.assertEqual(agreement[0, 1], 0.5)
+        self.assertAlmostEqual(agreement[0, 2], 1 / 3.0)
+        self.assertEqual(agreement[1, 0], agreement[0, 1])
+        self.assertTrue(numpy.isnan(agreement[3, 0]))
+        similarity = matrix.similarity()
+        self.assertAlmostEqual(similarity[0, 0], 1.0)
+        self.assertAlmostEqual(similarity[0, 2], -1 / 3.0)
+    
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_async(self):
+        api = self.make_async_api()
+        pending = api.compare_many([1, 2, 3, 2, 4], max_workers=2)
+        matrix = pending.result(timeout=10)
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertEqual(sorted(matrix.errors), [(1, 4), (2, 4), (3, 4)])
+        self.assertEqual(matrix.votes.tolist(), \
+            [[1, -1, 1], [1, 1, 0], [-1, -1, -1], [0, 0, 0]])
+        self.assertEqual(api.compare_many([1]).result().people, [1])
+
+
+class Snapshot(unittest.TestCase):
+    
+    def setUp(self):
+        self.bills = parse_bills()
+        self.bills[1].title_common = u'Caf\xe9 Act'
+        self.bills[1].bill_titles = [{'title': 'A'}]
+        self.bills[1].cosponsors = [self.bills[0].sponsor]
+        self.path = os.path.join(tempfile.mkdtemp(), 'bills.snapshot')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path))
+    
+    def state(self, node):
+        return repr(sorted(vars(node).items()))
+    
+    def test_round_trip(self):
+        opencongress.snapshot.save_snapshot(self.bills, self.path)
+        bills = opencongress.snapshot.load_snapshot(self.path)
+        self.assertEqual([self.state(bill) for bill in bills], \
+            [self.state(bill) for bill in self.bills])
+        bill = bills[0]
+        self.assertIsInstance(bill, opencongress.classes.Bill)
+        self.assertEqual(bill.updated.utcoffset(), \
+            self.bills[0].updated.utcoffset())
+        self.assertIsInstance(bill.fti_titles, opencongress.classes.Postings)
+        self.assertEqual(bill.fti_titles['clean'], [2, 7])
+        self.assertEqual(bill.co_sponsors[0]['person_id'], 400253)
+        self.assertEqual(bills[1].cosponsors[0].person_id, 400425)
+        self.assertEqual(bills[1].title_common, u'Caf\xe9 Act')
+        self.assertEqual(bills[1].bill_titles, [{'title': 'A'}])
+        self.assertRaises(AttributeError, getattr, bills[1], 'sponsor')
+    
+    def test_suspend_gc(self):
+        switched = []
+        class FakeGc(object):
+            isenabled = staticmethod(lambda: True)
+            disable = staticmethod(lambda: switched.append('disable'))
+            enable = staticmethod(lambda: switched.append('enable'))
+        self.addCleanup(setattr, opencongress.snapshot, 'gc', \
+            opencongress.snapshot.gc)
+        opencongress.snapshot.gc = FakeGc
+        opencongress.snapshot.save_snapshot(self.bills, self.path)
+        opencongress.snapshot.load_snapshot(self.path)
+        opencongress.snapshot.decode(opencongress.snapshot.encode(self.bills))
+        self.assertEqual(switched, [])
+        bills = opencongress.snapshot.load_snapshot(self.path, suspend_gc=True)
+        self.assertEqual(switched, ['disable', 'enable'])
+        self.assertEqual(len(bills), 2)
+    
+    def test_mixed_strings(self):
+        self.bills[0].title_common = 'Clean Energy Act'
+        opencongress.snapshot.save_snapshot(self.bills, self.path)
+        bills = opencongress.snapshot.load_snapshot(self.path)
+        self.assertEqual(bills[0].title_common, 'Clean Energy Act')
+        self.assertIsInstance(bills[0].title_common, str)
+        self.assertEqual(bills[1].title_common, u'Caf\xe9 Act')
+        self.assertIsInstance(bills[1].title_common, unicode)
+    
+    def test_microseconds(self):
+        import datetime
+        self.bills[0].updated = self.bills[0].updated.replace( \
+            microsecond=123456)
+        self.bills[1].updated = datetime.datetime(1969, 12, 31, 23, 59, 59, \
+            999999)
+        opencongress.snapshot.save_snapshot(self.bills, self.path)
+        bills = opencongress.snapshot.load_snapshot(self.path)
+        self.assertEqual([bill.updated for bill in bills], \
+            [bill.updated for bill in self.bills])
+        self.assertEqual(bills[0].updated.utcoffset(), \
+            self.bills[0].updated.utcoffset())
+    
+    def test_nested_votes(self):
+        from xml.etree import ElementTree
+        vote = opencongress.classes.Vote(ElementTree.fromstring(
+            '<vote><person1><vote>+</vote></person1>'
+            '<person2><vote>-</vote></person2>'
+            '<roll-call><id type="integer">7</id><question>Q</question>'
+            '</roll-call></vote>'))
+        opencongress.snapshot.save_snapshot([vote, self.bills[1]], self.path)
+        loaded, bill = opencongress.snapshot.load_snapshot(self.path)
+        self.assertEqual(str(loaded), 'Q')
+        self.assertEqual(loaded.roll_call.id, 7)
+        self.assertEqual(loaded.person1, '+')
+        self.assertEqual(bill.number, 3962)
+    
+    def test_bad_file(self):
+        with open(self.path, 'wb') as f:
+            f.write('<bills/>' * 4)
+        self.assertRaises(
+            opencongress.exceptions.ArgumentError,
+            opencongress.snapshot.load_snapshot,
+            self.path
+        )
+
+
+class BillStore(unittest.TestCase):
+    
+    def setUp(self):
+        self.bills = parse_bills()
+        self.path = os.path.join(tempfile.mkdtemp(), '111.bills')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path))
+    
+    def test_lookup(self):
+        senate = parse_bills('<bills>%s</bills>' % ''.join(
+            '<bill><session type="integer">111</session><bill-type>s'
+            '</bill-type><number type="integer">%s</number></bill>' % number \
+            for number in range(50, 0, -1)))
+        store = opencongress.billstore.BillStore.build(self.bills + senate, \
+            self.path)
+        try:
+            self.assertEqual(len(store), 52)
+            self.assertEqual(store['111-H2454'].title_full_common, \
+                self.bills[0].title_full_common)
+            self.assertEqual(store['111-h2454'].fti_titles['clean'], [2, 7])
+            self.assertEqual(store['111-s7'].number, 7)
+            self.assertTrue('111-s50' in store)
+            self.assertFalse('111-s51' in store)
+            self.assertEqual(store.get('111-s0'), None)
+            self.assertRaises(KeyError, lambda: store['110-h1'])
+            self.assertEqual(store[u'111-s12'].number, 12)
+            self.assertFalse(u'111-s\xe9' in store)
+            idents = list(store.idents())
+            self.assertEqual(idents, sorted(idents))
+            self.assertIsInstance(idents[0], str)
+        finally:
+            store.close()
+    
+    def test_shared(self):
+        opencongress.billstore.BillStore.build(self.bills, self.path).close()
+        with opencongress.billstore.BillStore(self.path) as first:
+            with opencongress.billstore.BillStore(self.path) as second:
+                self.assertEqual(first['111-h3962'].id, \
+                    second['111-h3962'].id)
+    
+    def test_bad_file(self):
+        open(self.path, 'wb').close()
+        self.assertRaises(
+            opencongress.exceptions.ArgumentError,
+            opencongress.billstore.BillStore,
+            self.path
+        )
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
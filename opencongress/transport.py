@@ -0,0 +1,484 @@
+import httplib, math, random, socket, threading, time, urlparse, StringIO, zlib
+
+
+class PooledResponse(object):
+    """
+    A response read off a pooled connection. The connection is handed back to
+    its pool when the response is closed; it is kept alive only if the body
+    was read to the end and the server did not ask to close it.
+    """
+    def __init__(self, pool, host, conn, response):
+        self._pool = pool
+        self._host = host
+        self._conn = conn
+        self._response = response
+        self.status = response.status
+
+    def getcode(self):
+        return self.status
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    def close(self):
+        if self._conn is None:
+            return
+        if self._response.length == 0:
+            # Bodyless responses (e.g. 304) are complete once read
+            self._response.read()
+        reusable = self._response.isclosed() and not self._response.will_close
+        self._response.close()
+        self._pool._release(self._host, self._conn, reusable)
+        self._conn = None
+
+
+class BufferedResponse(object):
+    """
+    A response whose body has already been read into memory, for transports
+    that do not hand out live connections.
+    """
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = dict((k.lower(), v) for k, v in headers.items())
+        self.body = body
+        self._fp = StringIO.StringIO(body)
+
+    def getcode(self):
+        return self.status
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def read(self, amt=None):
+        if amt is None:
+            return self._fp.read()
+        return self._fp.read(amt)
+
+    def close(self):
+        pass
+
+
+class FileResponse(object):
+    """
+    A response whose body is read from a file, e.g. a cache entry. Closing
+    the response closes the file.
+    """
+    def __init__(self, status, headers, fp):
+        self.status = status
+        self.headers = dict((k.lower(), v) for k, v in headers.items())
+        self._fp = fp
+
+    def getcode(self):
+        return self.status
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def read(self, amt=None):
+        if amt is None:
+            return self._fp.read()
+        return self._fp.read(amt)
+
+    def close(self):
+        self._fp.close()
+
+
+class DecodingReader(object):
+    """
+    Reads a response body, decompressing it chunk by chunk if it is gzipped.
+    Compression is detected from the gzip magic number at the start of the
+    body rather than the Content-Encoding header, which opencongress.org
+    does not send reliably.
+    """
+    _magic = '\x1f\x8b'
+
+    def __init__(self, fp, chunk_size=16384):
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._buffer = ''
+        self._decompressor = None
+        self._started = False
+        self._eof = False
+
+    def read(self, amt=None):
+        if not self._started:
+            self._start()
+        if amt is None:
+            chunks = [self._buffer]
+            self._buffer = ''
+            while not self._eof:
+                chunks.append(self._next())
+            return ''.join(chunks)
+        while len(self._buffer) < amt and not self._eof:
+            self._buffer += self._next()
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def _start(self):
+        self._started = True
+        head = ''
+        while len(head) < len(self._magic):
+            chunk = self._fp.read(self._chunk_size)
+            if not chunk:
+                self._eof = True
+                break
+            head += chunk
+        if head.startswith(self._magic):
+            # 16 + MAX_WBITS tells zlib to expect a gzip header and trailer
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self._buffer = self._decompressor.decompress(head)
+            if self._eof:
+                self._buffer += self._decompressor.flush()
+        else:
+            self._buffer = head
+
+    def _next(self):
+        chunk = self._fp.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            if self._decompressor is not None:
+                return self._decompressor.flush()
+            return ''
+        if self._decompressor is not None:
+            return self._decompressor.decompress(chunk)
+        return chunk
+
+
+class ConnectionPool(object):
+    """
+    A bounded pool of HTTP/1.1 keep-alive connections, shared by every call
+    made through an opencongress.Api instance.
+
+    >>> pool = ConnectionPool(maxsize=4)
+    >>> response = pool.urlopen('http://www.opencongress.org/api/people')
+
+    Parameters
+    ==========
+    maxsize = An integer specifying the maximum number of connections open to
+        a single host at once. Callers block until a connection is free.
+    timeout = A float specifying the socket timeout, in seconds
+
+    """
+
+    def __init__(self, maxsize=4, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+        self._open = 0
+        self._reused = 0
+
+    def urlopen(self, url, headers=None):
+        """
+        Issues a GET request for url and returns a PooledResponse. The caller
+        must close() the response to give its connection back to the pool.
+        """
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        host = (scheme, netloc)
+        if query:
+            path = '%s?%s' % (path, query)
+
+        self._slot(host).acquire()
+        try:
+            conn, reused = self._checkout(host)
+            try:
+                response = self._send(conn, path, headers)
+            except (httplib.HTTPException, socket.error):
+                self._discard(conn)
+                if not reused:
+                    raise
+                # The server dropped an idle keep-alive connection; try again
+                # once on a fresh one.
+                conn, reused = self._connect(host), False
+                try:
+                    response = self._send(conn, path, headers)
+                except (httplib.HTTPException, socket.error):
+                    self._discard(conn)
+                    raise
+        except:
+            self._slot(host).release()
+            raise
+        return PooledResponse(self, host, conn, response)
+
+    def stats(self):
+        """
+        Returns a dictionary of connection counts: 'open' (currently open),
+        'idle' (open and waiting in the pool) and 'reused' (requests served
+        over an already-open connection).
+        """
+        with self._lock:
+            return {
+                'open': self._open,
+                'idle': sum(len(conns) for conns in self._idle.values()),
+                'reused': self._reused,
+            }
+
+    def close(self):
+        """
+        Closes every idle connection.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+            for conns in idle.values():
+                for conn in conns:
+                    conn.close()
+                    self._open -= 1
+
+    def _send(self, conn, path, headers):
+        conn.request('GET', path, headers=headers or {})
+        return conn.getresponse()
+
+    def _slot(self, host):
+        with self._lock:
+            try:
+                return self._slots[host]
+            except KeyError:
+                slot = threading.BoundedSemaphore(self.maxsize)
+                self._slots[host] = slot
+                return slot
+
+    def _checkout(self, host):
+        with self._lock:
+            try:
+                conn = self._idle[host].pop()
+                self._reused += 1
+                return conn, True
+            except (KeyError, IndexError):
+                pass
+        return self._connect(host), False
+
+    def _connect(self, host):
+        scheme, netloc = host
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(netloc, timeout=self.timeout)
+        with self._lock:
+            self._open += 1
+        return conn
+
+    def _discard(self, conn):
+        conn.close()
+        with self._lock:
+            self._open -= 1
+
+    def _release(self, host, conn, reusable):
+        if reusable:
+            with self._lock:
+                self._idle.setdefault(host, []).append(conn)
+        else:
+            self._discard(conn)
+        self._slot(host).release()
+
+
+default_pool = ConnectionPool()
+
+
+class Throttle(object):
+    """
+    Paces, retries and limits the concurrency of the requests made through
+    an opencongress.Api instance:
+    
+    - a token bucket holds requests to rate per second on average, with
+      bursts of up to burst requests;
+    - responses with a retryable status (e.g. 503, or 429 when throttled by
+      the server) and connection errors are retried up to retries times,
+      after a jittered exponential backoff, or after the server's
+      Retry-After delay;
+    - the number of requests in flight is capped by a limit that halves
+      whenever a request fails and creeps back up, one request at a time,
+      as requests succeed.
+    
+    Apis sharing an API key should share a Throttle, so that the rate limit
+    applies to the key as a whole.
+    
+    >>> throttle = Throttle(rate=5, retries=3)
+    >>> api = opencongress.Api('api_key_here', throttle=throttle)
+    
+    Parameters
+    ==========
+    rate = A float specifying the average number of requests allowed per
+        second. Unlimited by default.
+    burst = An integer specifying how many requests may be made at once
+        after a quiet period. Defaults to rate, rounded up.
+    retries = An integer specifying how many times a failed request is
+        retried
+    backoff = A float specifying the base retry delay, in seconds. The n-th
+        retry waits a random time of up to backoff * 2 ** n seconds.
+    max_backoff = A float specifying the longest retry delay, in seconds
+    max_concurrency = An integer specifying the most requests allowed in
+        flight at once, which failures lower adaptively. Unlimited by
+        default.
+    min_concurrency = An integer specifying how far failures may lower the
+        concurrency limit
+    
+    """
+    
+    retry_statuses = frozenset([429, 500, 502, 503, 504])
+    
+    def __init__(self, rate=None, burst=None, retries=3, backoff=0.5, \
+                 max_backoff=30.0, max_concurrency=None, min_concurrency=1):
+        self.rate = rate
+        self.burst = burst or int(math.ceil(rate or 1))
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self._lock = threading.Lock()
+        self._slot_free = threading.Condition(self._lock)
+        self._tokens = float(self.burst)
+        self._refilled = time.time()
+        self._limit = float(max_concurrency or 0)
+        self._active = 0
+        self._requests = 0
+        self._retries = 0
+        self._failures = 0
+        self._waited = 0.0
+    
+    def bind(self, transport):
+        """
+        Returns a transport that sends requests through transport, throttled.
+        """
+        return ThrottledTransport(self, transport)
+    
+    def urlopen(self, transport, url, headers=None):
+        """
+        Issues a GET request for url through transport, retrying it as
+        needed. Returns the first response that is not retryable, or the
+        last one once retries run out.
+        """
+        attempt = 0
+        while True:
+            self._take_token()
+            self._acquire_slot()
+            try:
+                response = transport.urlopen(url, headers)
+            except (httplib.HTTPException, socket.error):
+                self._release_slot(ok=False)
+                if attempt >= self.retries:
+                    raise
+                delay = self._delay(attempt)
+            else:
+                ok = response.getcode() not in self.retry_statuses
+                if ok or attempt >= self.retries:
+                    return ThrottledResponse(response, \
+                        lambda: self._release_slot(ok))
+                delay = self._delay(attempt, \
+                    response.getheader('retry-after'))
+                response.close()
+                self._release_slot(ok=False)
+            attempt += 1
+            with self._lock:
+                self._retries += 1
+            time.sleep(delay)
+    
+    def stats(self):
+        """
+        Returns a dictionary of counts: 'requests' (sent, including retries),
+        'retries', 'failures' (retryable errors), 'waited' (seconds spent
+        waiting for the rate limit), 'active' (requests in flight) and
+        'concurrency' (the current concurrency limit, or None).
+        """
+        with self._lock:
+            return {
+                'requests': self._requests,
+                'retries': self._retries,
+                'failures': self._failures,
+                'waited': self._waited,
+                'active': self._active,
+                'concurrency': int(self._limit) if self.max_concurrency \
+                    else None,
+            }
+    
+    def _delay(self, attempt, retry_after=None):
+        try:
+            return min(float(retry_after), self.max_backoff)
+        except (TypeError, ValueError):
+            # Retry-After may also be an HTTP date; fall back to backoff
+            pass
+        return random.uniform(0, min(self.max_backoff, \
+            self.backoff * 2 ** attempt))
+    
+    def _take_token(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + \
+                    (now - self._refilled) * self.rate)
+                self._refilled = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+                self._waited += wait
+            time.sleep(wait)
+    
+    def _acquire_slot(self):
+        with self._lock:
+            while self.max_concurrency and self._active >= int(self._limit):
+                self._slot_free.wait()
+            self._active += 1
+            self._requests += 1
+    
+    def _release_slot(self, ok):
+        with self._lock:
+            self._active -= 1
+            if not self.max_concurrency:
+                if not ok:
+                    self._failures += 1
+                return
+            if ok:
+                # Additive increase: one more slot per limit's worth of
+                # successes
+                self._limit = min(self.max_concurrency, \
+                    self._limit + 1 / self._limit)
+            else:
+                # Multiplicative decrease
+                self._failures += 1
+                self._limit = max(self.min_concurrency, self._limit / 2)
+            self._slot_free.notify_all()
+
+
+class ThrottledTransport(object):
+    """
+    A transport that sends requests through another one, subject to a
+    Throttle.
+    """
+    def __init__(self, throttle, transport):
+        self.throttle = throttle
+        self.transport = transport
+    
+    def urlopen(self, url, headers=None):
+        return self.throttle.urlopen(self.transport, url, headers)
+
+
+class ThrottledResponse(object):
+    """
+    Wraps a response, calling on_close once it has been closed.
+    """
+    def __init__(self, response, on_close):
+        self._response = response
+        self._on_close = on_close
+        self.status = response.status
+    
+    def getcode(self):
+        return self._response.getcode()
+    
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+    
+    def read(self, amt=None):
+        return self._response.read(amt)
+    
+    def close(self):
+        self._response.close()
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close()
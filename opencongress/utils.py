@@ -1,5 +1,6 @@
 from opencongress.classes import *
-import re
+from datetime import date
+import os, re, tempfile
 
 def url_date(date):
     """
@@ -18,24 +19,70 @@ def url_date(date):
     
     return date.strftime('%b %d') + day_suffix + date.strftime(', %Y')
 
-def parse_mixed_result(result_set, value=None):
+def current_congress(today=None):
+    """
+    Returns the number of the Congress in session on the passed date
+    (defaults to today). Each Congress convenes on January 3rd of an
+    odd-numbered year.
+    
+    >>> import datetime
+    >>> current_congress(datetime.date(2010, 7, 4))
+    111
+    """
+    today = today or date.today()
+    year = today.year
+    if year % 2 and (today.month, today.day) < (1, 3):
+        year -= 1
+    return (year - 1789) // 2 + 1
+
+def write_atomically(path, write, reopen=False):
+    """
+    Calls write(f) with a temporary file in path's directory, then renames
+    it to path, so that readers see either the old file or the whole new
+    one. The temporary file is removed if anything fails.
+    
+    If reopen is True, returns the new file opened for reading. It is
+    opened before the rename, so that nothing can remove it in between.
+    
+    >>> write_atomically('/tmp/state.pickle', lambda f: pickle.dump(state, f))
+    """
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', \
+        dir=os.path.dirname(os.path.abspath(path)))
+    written = None
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        if reopen:
+            written = open(tmp, 'rb')
+        os.rename(tmp, path)
+    except:
+        if written is not None:
+            written.close()
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return written
+
+def parse_mixed_result(result_set, value=None, lazy=False):
     
     if result_set.tag == 'bill':
-        value = Bill(result_set)
+        value = Bill(result_set, lazy)
     
     elif result_set.tag.startswith('users'):
         value = int(result_set.text)
     
     elif result_set.tag == 'person':
-        value = Person(result_set)
+        value = Person(result_set, lazy)
     
     elif result_set.tag.endswith('issues'):
-        value = [Issue(elem) for elem in result_set.getchildren()]
+        value = [Issue(elem, lazy) for elem in result_set.getchildren()]
     
     elif result_set.tag.endswith('bills'):
-        value = [Bill(elem) for elem in result_set.getchildren()]
+        value = [Bill(elem, lazy) for elem in result_set.getchildren()]
     
     elif result_set.tag.endswith(('senators', 'representatives', 'people')):
-        value = [Person(elem) for elem in result_set.getchildren()]
+        value = [Person(elem, lazy) for elem in result_set.getchildren()]
     
     return value
\ No newline at end of file